@@ -0,0 +1,177 @@
+"""
+Benchmark of checkers.backup_all_instances against local stand-ins
+of odoo and yandex disk, reporting wall time, throughput, peak RSS
+and event loop lag for every instances x size combination.
+
+Needs postgres configured by PG_* environment variables. Its tables
+are TRUNCATED, so point PG_DATABASE at a throwaway database.
+Syncer settings, like BACKUP_CONCURRENCY or SPOOL_DIR, are taken
+from environment as well.
+
+    python benchmarks/backup_benchmark.py \\
+        --instances 10 100 --size-mb 10 100 --json results.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+from multiprocessing import get_context
+from fakes import start_disk, start_odoo, wait_for_port
+
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+DISK_HOST = "127.0.0.1"
+
+
+async def measure_lag(samples: list[float], interval: float = 0.05):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+async def seed(db, instances: int, hosts: int, odoo_port: int) -> None:
+    await db.pool.execute("""
+        TRUNCATE users, odoo_instances, backup_jobs, backup_chunks CASCADE;
+        INSERT INTO users (id, token, refresh_token, token_due_date)
+        VALUES (1, 'benchmark', 'benchmark', now() + interval '1 year');
+    """)
+    await db.pool.executemany("""
+        INSERT INTO odoo_instances
+            (owner, url, db_name, db_password, next_backup, cooldown)
+        VALUES (1, $1, $2, 'admin', now(), 1);
+    """, [(
+        f"http://127.0.0.{i % hosts + 1}:{odoo_port}/web/database/manager",
+        f"db{i}"
+    ) for i in range(instances)])
+
+
+async def run_case(instances: int, hosts: int, odoo_port: int) -> dict:
+    from database import Database
+    from migrations import MIGRATIONS
+    from tokens import TokenManager
+    from checkers import backup_all_instances
+    from http_clients import close_clients
+
+    db = await Database.connect(
+        host=os.environ["PG_HOST"],
+        port=int(os.environ["PG_PORT"]),
+        username=os.environ["PG_USER"],
+        password=os.environ["PG_PASSWORD"],
+        database=os.environ["PG_DATABASE"]
+    )
+    lag = []
+    try:
+        await db.migrate(MIGRATIONS)
+        await seed(db, instances, hosts, odoo_port)
+        lag_task = asyncio.create_task(measure_lag(lag))
+        start = time.perf_counter()
+        await backup_all_instances(db, TokenManager.from_env(db))
+        wall = time.perf_counter() - start
+        lag_task.cancel()
+        failed = await db.pool.fetchval("""
+            SELECT count(*) FROM backup_jobs WHERE status <> 'done';
+        """)
+    finally:
+        await db.close()
+        await close_clients()
+    lag.sort()
+    return {
+        "wall_seconds": wall,
+        "failed": failed,
+        "loop_lag_p99_ms": lag[int(len(lag) * 0.99)] * 1000 if lag else 0,
+        "loop_lag_max_ms": lag[-1] * 1000 if lag else 0
+    }
+
+
+def case_main(instances: int, hosts: int, odoo_port: int, results) -> None:
+    """
+    Run one case in fresh process, so peak RSS belongs to it only.
+    """
+    sys.path.insert(0, SRC)
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    result = asyncio.run(run_case(instances, hosts, odoo_port))
+    result["peak_rss_mb"] = \
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--instances", type=int, nargs="+", default=[10])
+    parser.add_argument("--size-mb", type=int, nargs="+", default=[10])
+    parser.add_argument("--speed-mbps", type=float, default=0,
+                        help="speed of every odoo backup, 0 is unlimited")
+    parser.add_argument("--hosts", type=int, default=4,
+                        help="count of distinct odoo hosts")
+    parser.add_argument("--odoo-port", type=int, default=18069)
+    parser.add_argument("--disk-port", type=int, default=18080)
+    parser.add_argument("--json", help="file to write results to")
+    args = parser.parse_args()
+
+    os.environ["YANDEX_DISK_API"] = \
+        f"http://{DISK_HOST}:{args.disk_port}/v1/disk"
+    disk, received = start_disk(DISK_HOST, args.disk_port)
+    wait_for_port(DISK_HOST, args.disk_port)
+    context = get_context("spawn")
+    results = []
+    try:
+        for size_mb in args.size_mb:
+            odoo_servers = []
+            for host in range(args.hosts):
+                address = f"127.0.0.{host + 1}"
+                odoo_servers.append(start_odoo(
+                    address,
+                    args.odoo_port,
+                    size_mb * 1024 ** 2,
+                    int(args.speed_mbps * 1024 ** 2)
+                ))
+                wait_for_port(address, args.odoo_port)
+            try:
+                for instances in args.instances:
+                    received.value = 0
+                    queue = context.Queue()
+                    case = context.Process(
+                        target=case_main,
+                        args=(instances, args.hosts, args.odoo_port, queue)
+                    )
+                    case.start()
+                    result = queue.get()
+                    case.join()
+                    result.update(
+                        instances=instances,
+                        size_mb=size_mb,
+                        uploaded_mb=received.value / 1024 ** 2,
+                        throughput_mb_s=received.value / 1024 ** 2
+                        / result["wall_seconds"]
+                    )
+                    results.append(result)
+                    print(
+                        f"{instances:>6} x {size_mb:>6} MB: "
+                        f"{result['wall_seconds']:8.2f} s, "
+                        f"{result['throughput_mb_s']:8.2f} MB/s, "
+                        f"RSS {result['peak_rss_mb']:7.1f} MB, "
+                        f"lag p99 {result['loop_lag_p99_ms']:6.1f} ms, "
+                        f"max {result['loop_lag_max_ms']:6.1f} ms, "
+                        f"failed {result['failed']}",
+                        flush=True
+                    )
+            finally:
+                for server in odoo_servers:
+                    server.terminate()
+                    server.join()
+    finally:
+        disk.terminate()
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Local stand-ins for odoo and yandex disk, used by benchmarks.
+"""
+import time
+import socket
+import asyncio
+from urllib.parse import parse_qs
+from multiprocessing import get_context
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import (
+    JSONResponse,
+    RedirectResponse,
+    StreamingResponse
+)
+import uvicorn
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def create_odoo_app(size: int, speed: int) -> FastAPI:
+    """
+    :param size: size of every backup in bytes
+    :param speed: bytes per second of every backup, 0 for unlimited
+    :return: app serving odoo backup endpoint
+    """
+    app = FastAPI()
+    block = bytes(range(256)) * (CHUNK_SIZE // 256)
+
+    async def generate_backup():
+        sent = 0
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        while sent < size:
+            chunk = block[:min(CHUNK_SIZE, size - sent)]
+            sent += len(chunk)
+            yield chunk
+            if speed:
+                delay = start + sent / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+    @app.post("/web/database/backup")
+    async def backup():
+        return StreamingResponse(
+            generate_backup(),
+            media_type="application/octet-stream",
+            headers={"Content-Length": str(size)}
+        )
+
+    return app
+
+
+def create_disk_app(base_url: str, received) -> FastAPI:
+    """
+    :param base_url: url the app is served on
+    :param received: shared counter of uploaded bytes
+    :return: app serving used part of yandex disk API
+    """
+    app = FastAPI()
+
+    @app.get("/v1/disk/resources/upload")
+    async def request_upload(path: str):
+        return {"href": f"{base_url}/upload/{path}"}
+
+    @app.put("/upload/{path:path}")
+    async def upload(request: Request):
+        async for chunk in request.stream():
+            with received.get_lock():
+                received.value += len(chunk)
+        return Response(status_code=201)
+
+    @app.put("/v1/disk/resources")
+    async def create_folder():
+        return Response(status_code=201)
+
+    @app.post("/v1/disk/resources/copy")
+    async def copy():
+        return JSONResponse(
+            {"href": f"{base_url}/v1/disk/operations/copy"},
+            status_code=202
+        )
+
+    @app.get("/v1/disk/operations/{operation}")
+    async def operation(operation: str):
+        return {"status": "success"}
+
+    return app
+
+
+def create_yandex_id_app(callback_url: str) -> FastAPI:
+    """
+    Authorization page grants access at once, codes and tokens
+    are derived from user id, so any of them can be checked
+    without keeping state.
+    :param callback_url: url of redirect_from_yandex endpoint
+    :return: app serving used part of oauth.yandex.ru and login.yandex.ru
+    """
+    app = FastAPI()
+
+    @app.get("/authorize")
+    async def authorize(state: str = "", user_id: int = 1):
+        # user_id stands for the account logged in to yandex
+        return RedirectResponse(
+            f"{callback_url}?code=code-{user_id}&state={state}",
+            status_code=302
+        )
+
+    @app.post("/token")
+    async def token(request: Request):
+        form = parse_qs((await request.body()).decode())
+        user_id = form["code"][0].removeprefix("code-")
+        return {
+            "access_token": f"token-{user_id}",
+            "refresh_token": f"refresh-{user_id}",
+            "expires_in": 31536000
+        }
+
+    @app.get("/info")
+    async def info(request: Request):
+        token = request.headers.get("Authorization", "")
+        if not token.startswith("OAuth token-"):
+            return Response(status_code=401)
+        return {"id": token.removeprefix("OAuth token-")}
+
+    return app
+
+
+def serve(app: FastAPI, host: str, port: int) -> None:
+    uvicorn.run(app, host=host, port=port, log_level="warning")
+
+
+context = get_context("fork")
+
+
+def start_odoo(host: str, port: int, size: int, speed: int):
+    process = context.Process(
+        target=serve,
+        args=(create_odoo_app(size, speed), host, port),
+        daemon=True
+    )
+    process.start()
+    return process
+
+
+def start_yandex_id(host: str, port: int, callback_url: str):
+    process = context.Process(
+        target=serve,
+        args=(create_yandex_id_app(callback_url), host, port),
+        daemon=True
+    )
+    process.start()
+    return process
+
+
+def start_disk(host: str, port: int):
+    """
+    :return: process of server and shared counter of uploaded bytes
+    """
+    received = context.Value("q", 0)
+    process = context.Process(
+        target=serve,
+        args=(create_disk_app(f"http://{host}:{port}", received), host, port),
+        daemon=True
+    )
+    process.start()
+    return process, received
+
+
+def wait_for_port(host: str, port: int, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
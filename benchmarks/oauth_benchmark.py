@@ -0,0 +1,232 @@
+"""
+Load test of subscribe, list and delete flows of the API, following
+the whole redirect chain through local stand-in of yandex oauth
+and reporting p50/p99 latency of every endpoint and throughput.
+
+Needs postgres and redis configured by PG_* and REDIS_CONNSTRING
+environment variables. Subscriptions of test users are left in
+database, so point PG_DATABASE at a throwaway database.
+
+    python benchmarks/oauth_benchmark.py \\
+        --clients 50 --duration 30 --api-workers 1 --json results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from collections import defaultdict
+from urllib.parse import urlparse
+import httpx
+from fakes import start_yandex_id, wait_for_port
+
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+HOST = "127.0.0.1"
+FLOWS = {
+    "subscribe": (
+        "/post_instance",
+        lambda user: {
+            "url": f"http://odoo-{user}.test/web/database/manager",
+            "db_name": "benchmark",
+            "db_password": "admin",
+            "cooldown": 1
+        }
+    ),
+    "list": ("/get_instance", lambda user: {}),
+    "delete": (
+        "/delete_instance",
+        lambda user: {
+            "url": f"http://odoo-{user}.test/web/database/manager",
+            "db_name": "benchmark"
+        }
+    )
+}
+
+
+def percentile(samples: list[float], share: float) -> float:
+    return samples[min(int(len(samples) * share), len(samples) - 1)]
+
+
+async def run_flow(
+        client: httpx.AsyncClient,
+        api_url: str,
+        flow: str,
+        user: int,
+        latencies: dict[str, list[float]]) -> None:
+    """
+    Walk redirects of one flow, timing requests to the API by route.
+    Raises *httpx.HTTPStatusError* when the flow doesn't end with 200.
+    """
+    path, get_params = FLOWS[flow]
+    request = client.build_request(
+        "GET", f"{api_url}{path}", params=get_params(user)
+    )
+    while True:
+        start = time.perf_counter()
+        response = await client.send(request)
+        if str(request.url).startswith(api_url):
+            latencies[request.url.path].append(time.perf_counter() - start)
+        if not response.is_redirect:
+            break
+        url = response.headers["Location"]
+        if urlparse(url).path.endswith("/authorize"):
+            url += f"&user_id={user}"
+        request = client.build_request("GET", url)
+    response.raise_for_status()
+
+
+async def run_client(
+        api_url: str,
+        users: range,
+        deadline: float,
+        latencies: dict[str, list[float]],
+        errors: list[str]) -> int:
+    """
+    Deletes only instances this client subscribed itself, so that
+    delete flow doesn't end with *ODOO_INSTANCE_NOT_EXIST*.
+
+    :param users: yandex accounts used by this client only
+    :return: count of completed flows
+    """
+    completed = 0
+    subscribed = set()
+    async with httpx.AsyncClient(timeout=30) as client:
+        while time.perf_counter() < deadline:
+            flow = random.choice(list(FLOWS))
+            if flow == "delete" and not subscribed:
+                flow = "subscribe"
+            if flow == "delete":
+                user = random.choice(list(subscribed))
+            else:
+                user = random.choice(users)
+            try:
+                await run_flow(client, api_url, flow, user, latencies)
+                completed += 1
+            except httpx.HTTPError as error:
+                errors.append(f"{flow}: {error!r}")
+                continue
+            if flow == "subscribe":
+                subscribed.add(user)
+            elif flow == "delete":
+                subscribed.discard(user)
+    return completed
+
+
+async def run_load(
+        api_url: str,
+        clients: int,
+        users: int,
+        duration: float) -> dict:
+    latencies = defaultdict(list)
+    errors = []
+    start = time.perf_counter()
+    completed = sum(await asyncio.gather(*(
+        run_client(
+            api_url,
+            range(index + 1, max(users, clients) + 1, clients),
+            start + duration,
+            latencies,
+            errors
+        )
+        for index in range(clients)
+    )))
+    wall = time.perf_counter() - start
+    endpoints = {}
+    for route, samples in sorted(latencies.items()):
+        samples.sort()
+        endpoints[route] = {
+            "requests": len(samples),
+            "p50_ms": percentile(samples, 0.5) * 1000,
+            "p99_ms": percentile(samples, 0.99) * 1000
+        }
+    return {
+        "flows_per_second": completed / wall,
+        "requests_per_second":
+            sum(len(samples) for samples in latencies.values()) / wall,
+        "errors": len(errors),
+        "first_errors": errors[:10],
+        "endpoints": endpoints
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--clients", type=int, default=20,
+                        help="count of concurrent clients")
+    parser.add_argument("--users", type=int, default=100,
+                        help="count of distinct yandex accounts, "
+                             "split between clients")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="seconds to generate load for")
+    parser.add_argument("--api-workers", type=int, default=1,
+                        help="count of uvicorn workers of the API")
+    parser.add_argument("--api-port", type=int, default=18000)
+    parser.add_argument("--oauth-port", type=int, default=18090)
+    parser.add_argument("--json", help="file to write results to")
+    args = parser.parse_args()
+
+    api_url = f"http://{HOST}:{args.api_port}"
+    oauth_url = f"http://{HOST}:{args.oauth_port}"
+    oauth = start_yandex_id(
+        HOST, args.oauth_port, f"{api_url}/accept_redirect"
+    )
+    subprocess.run(
+        [
+            sys.executable, "-c",
+            "import asyncio, main; asyncio.run(main.migrate())"
+        ],
+        cwd=SRC,
+        check=True
+    )
+    api = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", HOST,
+            "--port", str(args.api_port),
+            "--workers", str(args.api_workers),
+            "--log-level", "warning"
+        ],
+        cwd=SRC,
+        env={
+            **os.environ,
+            "ROOT_PATH": api_url,
+            "YANDEX_OAUTH_URL": oauth_url,
+            "YANDEX_LOGIN_URL": oauth_url,
+            "YANDEX_APP_ID": os.getenv("YANDEX_APP_ID", "benchmark"),
+            "YANDEX_APP_SECRET": os.getenv("YANDEX_APP_SECRET", "benchmark")
+        }
+    )
+    try:
+        wait_for_port(HOST, args.oauth_port)
+        wait_for_port(HOST, args.api_port, timeout=30)
+        result = asyncio.run(
+            run_load(api_url, args.clients, args.users, args.duration)
+        )
+    finally:
+        api.terminate()
+        api.wait()
+        oauth.terminate()
+    print(
+        f"{args.clients} clients, {args.api_workers} API workers: "
+        f"{result['flows_per_second']:.1f} flows/s, "
+        f"{result['requests_per_second']:.1f} requests/s, "
+        f"{result['errors']} errors"
+    )
+    for route, stats in result["endpoints"].items():
+        print(
+            f"{route:<32} {stats['requests']:>8} requests, "
+            f"p50 {stats['p50_ms']:7.1f} ms, p99 {stats['p99_ms']:7.1f} ms"
+        )
+    for error in result["first_errors"]:
+        print(error)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
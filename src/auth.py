@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends
-from cache import Cache
+from cache import Cache, INVALID_TOKEN
 from dependencies import get_cache
 from yandex import (
     YandexID,
@@ -18,6 +18,30 @@ from responses import (
 router = APIRouter()
 
 
+async def get_user_id(cache: Cache, token: str) -> int:
+    """
+    Get yandex id of token owner, asking login.yandex.ru only
+    when token is not cached. Rejected tokens are cached too.
+    Can raise *YandexTimeoutError*, *WrongTokenError*
+    and *YandexResponseError*.
+    :param cache: cache of yandex ids by token
+    :param token: access token of user
+    :return: user's id in yandex's system
+    """
+    user_id = await cache.get_user_id(token)
+    if user_id == INVALID_TOKEN:
+        raise WrongTokenError("Wrong token.")
+    if user_id is not None:
+        return int(user_id)
+    try:
+        user_id = await YandexID.get_user_id(token)
+    except WrongTokenError:
+        await cache.put_invalid_token(token)
+        raise
+    await cache.put_user_id(token, user_id)
+    return int(user_id)
+
+
 @router.get("/accept_redirect")
 async def redirect_from_yandex(
         code: str,
@@ -26,7 +50,7 @@ async def redirect_from_yandex(
     try:
         access_token, refresh_token, expires_in = \
             await YandexID.change_code_to_token(code)
-        user_yandex_id = await YandexID.get_user_id(access_token)
+        user_yandex_id = await get_user_id(cache, access_token)
     except YandexTimeoutError:
         return get_gateway_timeout_error(
             "Яндекс не ответил на наш запрос. Повторите попытку позже."
@@ -37,13 +61,14 @@ async def redirect_from_yandex(
         )
     except WrongTokenError:
         return get_bad_request_error("Неверный токен.")
-    await cache.extend_record(
+    record = await cache.extend_record(
         state,
         yandex_id=user_yandex_id,
         access_token=access_token,
         refresh_token=refresh_token,
         expires_in=expires_in
     )
-    redirect_url = (await cache.get_record(state))["redirect_url"]
-    redirect_url = f"{redirect_url}?uuid={state}"
+    if not record:
+        return get_bad_request_error("Данные запроса не найдены.")
+    redirect_url = f"{record['redirect_url']}?uuid={state}"
     return redirect_to(redirect_url)
@@ -1,14 +1,18 @@
+import json
 from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends
-from loguru import logger
+from fastapi.responses import JSONResponse
 from database import Database, StringTooLong
+from bulk import validate_instances
+from slots import parse_window, initial_slot
 from dependencies import get_database, get_request_data_from_cache
 from responses import (
     SUCCESS_INSERTION,
     SUCCESS_DELETION,
     ODOO_INSTANCE_NOT_EXIST,
     STRING_TOO_LONG,
-    serialize_instances
+    serialize_instances,
+    serialize_status
 )
 
 
@@ -19,53 +23,63 @@ router = APIRouter(prefix="/authorized")
 async def auth_post_instance(
         request_data: dict = Depends(get_request_data_from_cache),
         db: Database = Depends(get_database)):
-    if not await db.user_exists(int(request_data["yandex_id"])):
-        due_time = timedelta(seconds=int(request_data["expires_in"]))
-        due_date = datetime.now() + due_time
-        try:
-            await db.insert_user(
-                int(request_data["yandex_id"]),
-                request_data["access_token"],
-                request_data["refresh_token"],
-                due_date.date()
-            )
-        except StringTooLong:
-            logger.critical("Yandex token is too long.")
-            return
-    await db.delete_odoo_instance(
-        int(request_data["yandex_id"]),
-        request_data["url"],
-        request_data["db_name"]
-    )
+    due_time = timedelta(seconds=int(request_data["expires_in"]))
+    yandex_id = int(request_data["yandex_id"])
+    window = parse_window(request_data.get("backup_window", ""))
     try:
-        await db.insert_odoo_instance(
-            int(request_data["yandex_id"]),
+        await db.subscribe_odoo_instance(
+            yandex_id,
+            request_data["access_token"],
+            request_data["refresh_token"],
+            datetime.now() + due_time,
             request_data["url"],
             request_data["db_name"],
             request_data["db_password"],
-            int(request_data["cooldown"])
+            int(request_data["cooldown"]),
+            request_data.get("backup_format", "zip"),
+            initial_slot(
+                yandex_id,
+                request_data["url"],
+                request_data["db_name"],
+                *window
+            ),
+            *window
         )
     except StringTooLong:
         return STRING_TOO_LONG
     return SUCCESS_INSERTION
 
 
+@router.get("/post_instances")
+async def auth_post_instances(
+        request_data: dict = Depends(get_request_data_from_cache),
+        db: Database = Depends(get_database)):
+    yandex_id = int(request_data["yandex_id"])
+    records, report = validate_instances(
+        json.loads(request_data["instances"]), yandex_id
+    )
+    if records:
+        due_time = timedelta(seconds=int(request_data["expires_in"]))
+        await db.subscribe_odoo_instances(
+            yandex_id,
+            request_data["access_token"],
+            request_data["refresh_token"],
+            datetime.now() + due_time,
+            records
+        )
+    return JSONResponse(report)
+
+
 @router.get("/delete_instance")
 async def auth_delete_instance(
         request_data: dict = Depends(get_request_data_from_cache),
         db: Database = Depends(get_database)):
-    if await db.odoo_instance_exists(
+    if await db.delete_odoo_instance(
             int(request_data["yandex_id"]),
             request_data["url"],
             request_data["db_name"]):
-        await db.delete_odoo_instance(
-            int(request_data["yandex_id"]),
-            request_data["url"],
-            request_data["db_name"]
-        )
         return SUCCESS_DELETION
-    else:
-        return ODOO_INSTANCE_NOT_EXIST
+    return ODOO_INSTANCE_NOT_EXIST
 
 
 @router.get("/get_instance")
@@ -74,3 +88,14 @@ async def auth_get_instance(
         db: Database = Depends(get_database)):
     instances = await db.get_instances_of_user(int(request_data["yandex_id"]))
     return serialize_instances(instances)
+
+
+@router.get("/status")
+async def auth_get_status(
+        request_data: dict = Depends(get_request_data_from_cache),
+        db: Database = Depends(get_database)):
+    runs = await db.get_latest_runs(
+        int(request_data["yandex_id"]),
+        int(request_data["runs"])
+    )
+    return serialize_status(runs)
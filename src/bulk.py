@@ -0,0 +1,122 @@
+"""
+Module parsing and validating bodies of bulk subscription.
+"""
+import io
+import os
+import csv
+import json
+from recompress import FORMATS
+from slots import parse_window, initial_slot
+
+
+BULK_MAX_INSTANCES = int(os.getenv("BULK_MAX_INSTANCES", "1000"))
+FIELDS = ("url", "db_name", "db_password", "cooldown")
+OPTIONAL_FIELDS = ("backup_format", "backup_window")
+MAX_LENGTHS = {"url": 140, "db_name": 80, "db_password": 80}
+
+
+def parse_instances(body: bytes, content_type: str) -> list[dict]:
+    """
+    Can raise *BulkFormatError*.
+    :param body: JSON list of objects or CSV with header row,
+    both with url, db_name, db_password, cooldown
+    and optional backup_format and backup_window fields
+    :param content_type: value of Content-Type header
+    :return: list of rows as they were sent
+    """
+    try:
+        text = body.decode()
+        if content_type.startswith("text/csv"):
+            rows = list(csv.DictReader(io.StringIO(text, newline="")))
+        else:
+            rows = json.loads(text)
+    except (UnicodeDecodeError, csv.Error, json.JSONDecodeError) as error:
+        raise BulkFormatError(f"Body can't be parsed: {error}.")
+    if not isinstance(rows, list) \
+            or not all(isinstance(row, dict) for row in rows):
+        raise BulkFormatError("Body must be a list of objects.")
+    if not rows:
+        raise BulkFormatError("Body has no instances.")
+    if len(rows) > BULK_MAX_INSTANCES:
+        raise BulkFormatError(
+            f"Body has more than {BULK_MAX_INSTANCES} instances."
+        )
+    return rows
+
+
+def validate_row(row: dict) -> str | None:
+    """
+    :return: reason why row can't be subscribed or None if it can
+    """
+    for field in FIELDS:
+        if row.get(field) in (None, ""):
+            return f"Field {field} is missing."
+    for field in FIELDS + OPTIONAL_FIELDS:
+        value = row.get(field)
+        if value is not None and (
+                isinstance(value, bool)
+                or not isinstance(value, (str, int))):
+            return f"Field {field} must be a string or an integer."
+    for field, max_length in MAX_LENGTHS.items():
+        if len(str(row[field])) > max_length:
+            return f"Field {field} is longer than {max_length}."
+    if not str(row["url"]).endswith("manager"):
+        return "Wrong odoo url format. It must be link to odoo " \
+               "database manager, like 'BASE_URL/web/database/manager'"
+    try:
+        if int(row["cooldown"]) < 1:
+            return "Cooldown must be positive."
+    except (TypeError, ValueError):
+        return "Cooldown must be integer."
+    if (row.get("backup_format") or "zip") not in FORMATS:
+        return "Wrong backup format. It must be 'zip' or 'zst'."
+    try:
+        parse_window(row.get("backup_window") or "")
+    except (TypeError, ValueError):
+        return "Wrong backup window. It must be like '22:00-06:00'."
+    return None
+
+
+def validate_instances(
+        rows: list[dict],
+        owner: int) -> tuple[list[tuple], list[dict]]:
+    """
+    :param rows: rows returned by *parse_instances*
+    :param owner: yandex id of user subscribing instances
+    :return: records of valid instances for
+    Database.subscribe_odoo_instances and report with status
+    of every row, in which valid rows are marked subscribed
+    """
+    records = []
+    report = []
+    seen = set()
+    for number, row in enumerate(rows, 1):
+        error = validate_row(row)
+        key = (str(row.get("url")), str(row.get("db_name")))
+        if error is None and key in seen:
+            error = "Instance is repeated in body."
+        report.append({
+            "row": number,
+            "url": row.get("url"),
+            "db_name": row.get("db_name"),
+            "status": "rejected" if error else "subscribed",
+            "error": error
+        })
+        if error is not None:
+            continue
+        seen.add(key)
+        window = parse_window(row.get("backup_window") or "")
+        records.append((
+            str(row["url"]),
+            str(row["db_name"]),
+            str(row["db_password"]),
+            int(row["cooldown"]),
+            row.get("backup_format") or "zip",
+            initial_slot(owner, str(row["url"]), str(row["db_name"]), *window),
+            *window
+        ))
+    return records, report
+
+
+class BulkFormatError(Exception):
+    pass
@@ -1,30 +1,107 @@
 """
 Module with caching class.
 """
+import os
+import hashlib
 import redis.asyncio as redis
+from metrics import timed
+
+
+USER_ID_TTL = int(os.getenv("YANDEX_USER_ID_TTL", "3600"))
+INVALID_TOKEN_TTL = int(os.getenv("YANDEX_INVALID_TOKEN_TTL", "300"))
+INVALID_TOKEN = "invalid"
+
+
+EXTEND_RECORD = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return {}
+end
+redis.call("HSET", KEYS[1], unpack(ARGV))
+return redis.call("HGETALL", KEYS[1])
+"""
 
 
 class Cache:
-    def __init__(self, connection_string: str):
-        self.redis = redis.from_url(connection_string, decode_responses=True)
+    def __init__(self, connection_string: str, max_connections: int = 50):
+        """
+        Create client over pool of connections to redis. Instance is
+        meant to be created once per process and shared.
+        :param connection_string: url of redis
+        :param max_connections: max count of connections in pool
+        """
+        self.redis = redis.from_url(
+            connection_string,
+            decode_responses=True,
+            max_connections=max_connections
+        )
+        self.extend_script = self.redis.register_script(EXTEND_RECORD)
 
     async def close(self) -> None:
         await self.redis.close()
 
+    @timed("redis")
     async def put_record(self, uuid: str, **kwargs) -> None:
-        await self.redis.hset(uuid, mapping=kwargs)
-        await self.redis.expire(uuid, 1800)
+        await self.redis.pipeline(transaction=True) \
+            .hset(uuid, mapping=kwargs) \
+            .expire(uuid, 1800) \
+            .execute()
 
+    @timed("redis")
     async def get_record(self, uuid) -> dict[str, str]:
         return await self.redis.hgetall(uuid)
 
-    async def extend_record(self, uuid: str, **kwargs) -> None:
-        storage = await self.redis.hgetall(uuid)
-        storage.update(kwargs)
-        await self.redis.hset(uuid, mapping=storage)
+    @timed("redis")
+    async def extend_record(self, uuid: str, **kwargs) -> dict[str, str]:
+        """
+        Add fields to existing record in one round trip.
+        Expired or missing record is not created again.
+        :param uuid: key of record
+        :return: whole updated record or empty dict if it doesn't exist
+        """
+        args = [item for pair in kwargs.items() for item in pair]
+        res = await self.extend_script(keys=[uuid], args=args)
+        return dict(zip(res[::2], res[1::2]))
 
+    @timed("redis")
+    async def pop_record(self, uuid: str) -> dict[str, str]:
+        """
+        Atomically get record and delete it in one round trip.
+        :param uuid: key of record
+        :return: record or empty dict if it doesn't exist
+        """
+        record, _ = await self.redis.pipeline(transaction=True) \
+            .hgetall(uuid) \
+            .delete(uuid) \
+            .execute()
+        return record
+
+    @timed("redis")
     async def delete_record(self, uuid: str) -> None:
         await self.redis.delete(uuid)
 
+    @timed("redis")
     async def record_exists(self, uuid: str) -> bool:
         return await self.redis.exists(uuid)
+
+    @staticmethod
+    def token_key(token: str) -> str:
+        return f"yandex_user:{hashlib.sha256(token.encode()).hexdigest()}"
+
+    @timed("redis")
+    async def get_user_id(self, token: str) -> str | None:
+        """
+        :param token: access token of yandex user
+        :return: cached yandex id of user, INVALID_TOKEN if token
+        was rejected recently or None if token is unknown
+        """
+        return await self.redis.get(self.token_key(token))
+
+    @timed("redis")
+    async def put_user_id(self, token: str, user_id: int | str) -> None:
+        await self.redis.set(self.token_key(token), user_id, ex=USER_ID_TTL)
+
+    @timed("redis")
+    async def put_invalid_token(self, token: str) -> None:
+        await self.redis.set(
+            self.token_key(token), INVALID_TOKEN, ex=INVALID_TOKEN_TTL
+        )
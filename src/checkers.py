@@ -1,88 +1,425 @@
 import os
+import sys
+import time
+import shutil
+import socket
 import asyncio
+import tempfile
+from zipfile import BadZipFile
+from contextlib import aclosing, contextmanager, suppress
 from urllib.parse import urlparse
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import partial
+from typing import Awaitable, Callable
 from database import Database
-from yandex import YandexID, YandexDisk, YandexResponseError
-from odoo import get_odoo_backup, OdooRequestError
+from yandex import YandexDisk, YandexResponseError, WrongTokenError
+from odoo import stream_odoo_backup, OdooRequestError, CHUNK_SIZE
+from spool import Spool, SpoolFullError
+from digest import StreamDigest, file_digest, zip_content_digest
+from dedup import ChunkStore, MANIFEST_SUFFIX
+from recompress import FORMATS, recompress, RecompressUnavailableError
+from scheduler import BackupScheduler
+from tokens import TokenManager
+from history import RunHistory
+from stall import Progress, StallLimits, StalledTransferError, rechunk
+from metrics import (
+    timed_stream,
+    ODOO_DOWNLOAD_SECONDS,
+    YANDEX_UPLOAD_SECONDS,
+    BACKUP_SECONDS,
+    BACKUP_BYTES_PER_SECOND,
+    BACKUP_SIZE_BYTES,
+    BACKUP_ERRORS,
+    BACKUPS_IN_FLIGHT,
+    BACKUP_JOBS_DUE
+)
 from loguru import logger
 
 
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", "3"))
+UPLOAD_RETRY_DELAY = int(os.getenv("UPLOAD_RETRY_DELAY", "30"))
+BACKUP_DEDUP = os.getenv("BACKUP_DEDUP", "container")
+BACKUP_MODE = os.getenv("BACKUP_MODE", "full")
+BACKUP_LEASE_SECONDS = int(os.getenv("BACKUP_LEASE_SECONDS", "600"))
+BACKUP_MAX_ATTEMPTS = int(os.getenv("BACKUP_MAX_ATTEMPTS", "3"))
+BACKUP_RETRY_DELAY = int(os.getenv("BACKUP_RETRY_DELAY", "600"))
+BACKUP_CLAIM_BATCH = int(os.getenv("BACKUP_CLAIM_BATCH", "32"))
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+STALL_LIMITS = StallLimits.from_env()
+
+
+async def upload_from_spool(
+        disk: YandexDisk,
+        spool: Spool,
+        filename: str,
+        limits: StallLimits) -> None:
+    """
+    Upload spooled backup to yandex disk, retrying stalled or failed
+    upload with exponential backoff. Can raise *YandexResponseError*
+    and *StalledTransferError* when all attempts failed.
+    :param disk: instance of YandexDisk of backup owner
+    :param spool: spool where backup was downloaded
+    :param filename: name of backup both in spool and on disk
+    :param limits: limits of upload progress
+    """
+    for attempt in range(UPLOAD_RETRIES):
+        progress = Progress()
+        try:
+            async with aclosing(
+                    progress.track(spool.read(filename))) as file:
+                await limits.guard(
+                    disk.put_file(filename, file),
+                    progress,
+                    "Upload"
+                )
+            return
+        except (YandexResponseError, StalledTransferError):
+            if attempt == UPLOAD_RETRIES - 1:
+                raise
+            delay = UPLOAD_RETRY_DELAY * 2 ** attempt
+            logger.warning(
+                f"Upload of {filename} failed, retrying in {delay} seconds"
+            )
+            await asyncio.sleep(delay)
+
+
+async def spooled_digest(
+        spool: Spool,
+        filename: str,
+        digest: StreamDigest) -> tuple[str, int]:
+    """
+    Get digest and size of spooled backup. Digest computed while
+    downloading is used when possible, the file is read again only
+    when it was downloaded by earlier attempt or contents of zip
+    are compared.
+    """
+    path = spool.path(filename)
+    if BACKUP_DEDUP == "content":
+        return (
+            await asyncio.to_thread(zip_content_digest, path),
+            os.path.getsize(path)
+        )
+    if digest.size == 0:
+        return (
+            await asyncio.to_thread(file_digest, path),
+            os.path.getsize(path)
+        )
+    return digest.hexdigest(), digest.size
+
+
+async def recompress_spooled(spool: Spool, filename: str) -> str:
+    """
+    Recompress spooled zip backup with zstd next to it.
+    Falls back to zip when zstandard is not installed.
+    :return: name of file in spool to upload
+    """
+    upload_name = filename.removesuffix(FORMATS["zip"]) + FORMATS["zst"]
+    if spool.exists(upload_name):
+        return upload_name
+    spool.in_use.add(upload_name)
+    size = os.path.getsize(spool.path(filename))
+    await spool.reserve(size)
+    try:
+        await recompress(spool.path(filename), spool.path(upload_name))
+    except RecompressUnavailableError:
+        logger.warning("zstandard is not installed, uploading zip instead")
+        spool.release(upload_name)
+        return filename
+    finally:
+        spool.unreserve(size)
+    return upload_name
+
+
+@contextmanager
+def stage(report: dict, name: str):
+    """
+    Save duration of backup stage into report, adding it
+    to time of stage with the same name if there was one.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        report["stages"][name] = report["stages"].get(name, 0) \
+            + time.perf_counter() - start
+
+
 async def backup_odoo_instance(
         ya_token: str,
         odoo_url: str,
         db_name: str,
-        db_password: str):
-    disk = YandexDisk(ya_token)
+        db_password: str,
+        spool: Spool | None = None,
+        refresh_token: Callable[[str], Awaitable[str]] | None = None,
+        last_backup: dict | None = None,
+        chunk_store: Callable[[YandexDisk], ChunkStore] | None = None,
+        backup_format: str = "zip",
+        limits: StallLimits = STALL_LIMITS) -> dict:
+    """
+    Make backup of odoo database and upload it to yandex disk.
+    When backup is spooled and has the same digest as previous one,
+    previous one is copied on yandex side instead of uploading.
+    Errors are logged and not raised.
+    :param refresh_token: called by YandexDisk when token is rejected
+    :param last_backup: dict with "hash" and "path" of previous backup
+    :param chunk_store: factory of ChunkStore, when passed backup
+    is uploaded incrementally by chunks instead of spooling it
+    :param backup_format: "zip" to upload backup as is, "zst" to
+    recompress it, which needs spool
+    :param limits: limits of download and upload progress, stalled
+    transfer is cancelled
+    :return: dict with "error" - name of error class if backup failed,
+    "hash", "size" and "path" of backup and "stages" - seconds spent
+    on "download", "recompress" and "upload" stages, download is a part
+    of upload when backup is not spooled
+    """
+    disk = YandexDisk(ya_token, refresh_token)
+    today = datetime.now().date()
+    url = urlparse(odoo_url)
+    filename = (f"{url.netloc}-{db_name}-"
+                f"{today.year}-{today.month}-{today.day}.zip")
+    upload_name = filename
+    report = {
+        "error": None,
+        "hash": None,
+        "size": None,
+        "path": filename,
+        "stages": {}
+    }
+    digest = StreamDigest()
+    progress = Progress()
+    uploaded = False
+    file = rechunk(progress.track(timed_stream(
+        stream_odoo_backup(odoo_url, db_name, db_password, None),
+        ODOO_DOWNLOAD_SECONDS.labels(url.netloc)
+    )), CHUNK_SIZE)
+    if chunk_store is None:
+        file = digest.wrap(file)
     try:
-        file = await get_odoo_backup(odoo_url, db_name, db_password)
-        today = datetime.now().date()
-        url = urlparse(odoo_url)
-        await disk.put_file(f"{url.netloc}-{db_name}-"
-                            f"{today.year}-{today.month}-"
-                            f"{today.day}.zip", file)
+        if chunk_store is not None:
+            with YANDEX_UPLOAD_SECONDS.time(), stage(report, "upload"):
+                report["hash"], report["size"] = await limits.guard(
+                    chunk_store(disk).put_backup(filename, file),
+                    progress,
+                    "Transfer",
+                    first_byte=True
+                )
+            report["path"] = f"{filename}{MANIFEST_SUFFIX}"
+        elif spool is None:
+            with YANDEX_UPLOAD_SECONDS.time(), stage(report, "upload"):
+                await limits.guard(
+                    disk.put_file(filename, file),
+                    progress,
+                    "Transfer",
+                    first_byte=True
+                )
+            report["hash"], report["size"] = digest.hexdigest(), digest.size
+        else:
+            if not spool.exists(filename):
+                with stage(report, "download"):
+                    await limits.guard(
+                        spool.write(filename, file),
+                        progress,
+                        "Download",
+                        first_byte=True
+                    )
+            report["hash"], report["size"] = \
+                await spooled_digest(spool, filename, digest)
+            if backup_format == "zst":
+                with stage(report, "recompress"):
+                    upload_name = await recompress_spooled(spool, filename)
+                report["path"] = upload_name
+            if last_backup and last_backup["path"] \
+                    and last_backup["path"].endswith(FORMATS[backup_format]) \
+                    and last_backup["hash"] == report["hash"]:
+                try:
+                    with stage(report, "upload"):
+                        await disk.copy_file(last_backup["path"], upload_name)
+                    uploaded = True
+                    logger.info(
+                        f"{url.netloc}/{db_name} is unchanged, "
+                        "previous backup was copied"
+                    )
+                except YandexResponseError:
+                    logger.warning(
+                        "Copying previous backup failed, "
+                        f"uploading it - {odoo_url} - {db_name}"
+                    )
+            if not uploaded:
+                with YANDEX_UPLOAD_SECONDS.time(), stage(report, "upload"):
+                    await upload_from_spool(disk, spool, upload_name, limits)
+        uploaded = True
         logger.info(f"{url.netloc}/{db_name} was successfully backup")
     except OdooRequestError:
+        report["error"] = OdooRequestError.__name__
         logger.error(
             "Odoo error was caught while making "
             f"backup - {odoo_url} - {db_name}"
         )
     except YandexResponseError:
+        report["error"] = YandexResponseError.__name__
         logger.error(
             "Yandex error was caught while "
             f"making backup - {odoo_url} - {db_name}"
         )
+    except WrongTokenError:
+        report["error"] = WrongTokenError.__name__
+        logger.error(
+            "Yandex rejected token while "
+            f"making backup - {odoo_url} - {db_name}"
+        )
+    except StalledTransferError as error:
+        report["error"] = error.reason
+        logger.error(
+            f"{error.reason} was caught while making "
+            f"backup - {odoo_url} - {db_name}"
+        )
+    except SpoolFullError:
+        report["error"] = SpoolFullError.__name__
+        logger.error(
+            "Spool is full, backup was dropped - "
+            f"{odoo_url} - {db_name}"
+        )
+    except BadZipFile:
+        report["error"] = BadZipFile.__name__
+        logger.error(
+            "Odoo sent something other than zip archive - "
+            f"{odoo_url} - {db_name}"
+        )
     finally:
-        await disk.close()
+        await file.aclose()
+        if spool is not None:
+            spool.release(filename, remove=uploaded)
+            spool.release(upload_name, remove=uploaded)
+    return report
 
 
-async def refresh_yandex_tokens():
-    db = await Database.connect(
-        host=os.environ["PG_HOST"],
-        port=int(os.environ["PG_PORT"]),
-        username=os.environ["PG_USER"],
-        password=os.environ["PG_PASSWORD"],
-        database=os.environ["PG_DATABASE"]
-    )
-    try:
-        users_to_refresh = await db.get_tokens_to_refresh()
-        for user in users_to_refresh:
-            try:
-                token, refresh_token, expires_in = \
-                    YandexID.get_new_token(user["refresh_token"])
-            except YandexResponseError:
-                logger.error("Yandex error was caught while refreshing token.")
-                continue
-            due_time = timedelta(seconds=expires_in)
-            due_date = datetime.now() + due_time
-            await db.update_user_token(
-                yandex_id=user["id"],
-                new_token=token,
-                new_refresh_token=refresh_token,
-                new_due_date=due_date.date()
+async def keep_leases(db: Database, history: RunHistory) -> None:
+    """
+    Extend leases of running jobs until cancelled. Errors are logged
+    and retried on the next beat, because jobs which lost their
+    leases are claimed again and backed up twice.
+    """
+    while True:
+        await asyncio.sleep(BACKUP_LEASE_SECONDS / 3)
+        try:
+            await db.extend_backup_leases(WORKER_ID, BACKUP_LEASE_SECONDS)
+            BACKUP_JOBS_DUE.set(await db.count_due_backup_jobs())
+            await history.flush()
+        except Exception:
+            logger.exception("Heartbeat of backup jobs failed.")
+
+
+def observe_backup(report: dict, host: str, duration: float) -> None:
+    if report["error"] is not None:
+        BACKUP_ERRORS.labels(report["error"]).inc()
+        BACKUP_SECONDS.labels("failure").observe(duration)
+        return
+    BACKUP_SECONDS.labels("success").observe(duration)
+    BACKUP_SIZE_BYTES.observe(report["size"])
+    BACKUP_BYTES_PER_SECOND.labels(host).observe(report["size"] / duration)
+
+
+async def run_backup_job(
+        db: Database,
+        tokens: TokenManager,
+        job: dict,
+        spool: Spool | None,
+        history: RunHistory):
+    """
+    Run claimed job, its log records carry "job_id" in extra.
+    """
+    with logger.contextualize(job_id=job["id"]):
+        started_at = datetime.now()
+        start = time.perf_counter()
+        try:
+            with BACKUPS_IN_FLIGHT.track_inprogress():
+                report = await backup_odoo_instance(
+                    job["token"],
+                    job["url"],
+                    job["db_name"],
+                    job["db_password"],
+                    spool,
+                    partial(tokens.refresh_token, job["owner"]),
+                    {
+                        "hash": job["last_backup_hash"],
+                        "path": job["last_backup_path"]
+                    },
+                    partial(ChunkStore, db, owner=job["owner"])
+                    if BACKUP_MODE == "incremental" else None,
+                    job["backup_format"],
+                    STALL_LIMITS.override(
+                        job["min_bytes_per_second"], job["first_byte_timeout"]
+                    )
+                )
+        except Exception as error:
+            logger.exception(
+                "Unexpected error was caught while making "
+                f"backup - {job['url']} - {job['db_name']}"
+            )
+            report = {
+                "error": type(error).__name__,
+                "hash": None,
+                "size": None,
+                "path": None,
+                "stages": {}
+            }
+        observe_backup(report, urlparse(job["url"]).netloc,
+                       time.perf_counter() - start)
+        await history.record(job, report, started_at, datetime.now())
+        if report["error"] is None:
+            await db.complete_backup_job(
+                job["id"],
+                WORKER_ID,
+                report["hash"],
+                report["size"],
+                report["path"]
+            )
+        else:
+            await db.fail_backup_job(
+                job["id"],
+                WORKER_ID,
+                report["error"],
+                BACKUP_RETRY_DELAY,
+                BACKUP_MAX_ATTEMPTS
             )
-            logger.info(f"Refreshed token for {user['id']}")
-    finally:
-        await db.close()
 
 
-async def backup_all_instances():
-    db = await Database.connect(
-        host=os.environ["PG_HOST"],
-        port=int(os.environ["PG_PORT"]),
-        username=os.environ["PG_USER"],
-        password=os.environ["PG_PASSWORD"],
-        database=os.environ["PG_DATABASE"]
-    )
+async def backup_all_instances(
+        db: Database,
+        tokens: TokenManager,
+        shard: int = 0,
+        shards: int = 1):
+    spool = Spool.from_env(shard, shards)
+    scratch = spool or Spool(tempfile.mkdtemp(), sys.maxsize)
+    scheduler = BackupScheduler.from_env()
+    history = RunHistory(db)
+    await db.enqueue_due_backups(BACKUP_MAX_ATTEMPTS)
+    BACKUP_JOBS_DUE.set(await db.count_due_backup_jobs())
+    heartbeat = asyncio.create_task(keep_leases(db, history))
     try:
-        instances = await db.get_odoo_instances_to_backup()
-        await asyncio.gather(*[
-            backup_odoo_instance(
-                inst["token"],
-                inst["url"],
-                inst["db_name"],
-                inst["db_password"]
-            ) for inst in instances
-        ])
+        await scheduler.run(
+            lambda limit, held, host_limit: db.claim_backup_jobs(
+                WORKER_ID,
+                limit,
+                BACKUP_LEASE_SECONDS,
+                BACKUP_MAX_ATTEMPTS,
+                shard,
+                shards,
+                held,
+                host_limit
+            ),
+            lambda job: run_backup_job(
+                db, tokens, job,
+                spool if job["backup_format"] == "zip" else scratch,
+                history
+            ),
+            BACKUP_CLAIM_BATCH
+        )
     finally:
-        await db.close()
+        heartbeat.cancel()
+        with suppress(asyncio.CancelledError):
+            await heartbeat
+        await history.flush()
+        if scratch is not spool:
+            shutil.rmtree(scratch.directory, ignore_errors=True)
@@ -1,125 +1,274 @@
 """
 Module providing interface to database.
 """
-from datetime import date
+import asyncio
+from datetime import datetime
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
 import asyncpg
+from metrics import timed
 
 
-class Database:
-    @staticmethod
-    async def create_tables(
-            host: str,
-            port: int,
-            username: str,
-            password: str,
-            database: str) -> None:
-        conn = await asyncpg.connect(
-            host=host,
-            port=port,
-            user=username,
-            password=password,
-            database=database
-        )
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id              BIGINT PRIMARY KEY,
-                token           VARCHAR(120) NOT NULL,
-                refresh_token   VARCHAR(120) NOT NULL,
-                token_due_date  DATE NOT NULL
-            );
-            
-            CREATE TABLE IF NOT EXISTS odoo_instances (
-                owner           BIGINT REFERENCES users(id)
-                    ON UPDATE CASCADE ON DELETE CASCADE,
-                url             VARCHAR(140),
-                db_name         VARCHAR(80),
-                db_password     VARCHAR(80) NOT NULL,
-                next_backup     DATE NOT NULL,
-                cooldown        INT NOT NULL,
-                PRIMARY KEY (owner, url, db_name)
-            );
-        """)
-        await conn.close()
+MIGRATIONS_LOCK = 70000001
+SYNCER_LOCK = 70000002
+
 
+class Database:
     @classmethod
     async def connect(
             cls, host: str,
             port: int,
             username: str,
             password: str,
-            database: str):
-        conn = await asyncpg.connect(
+            database: str,
+            min_size: int = 2,
+            max_size: int = 10):
+        """
+        Create pool of connections to database. Instance is meant
+        to be created once per process and shared.
+        :param min_size: count of connections opened at start
+        :param max_size: max count of connections in pool
+        :return: instance of Database
+        """
+        pool = await asyncpg.create_pool(
             host=host,
             port=port,
             user=username,
             password=password,
-            database=database
+            database=database,
+            min_size=min_size,
+            max_size=max_size
         )
-        return cls(conn)
+        return cls(pool)
 
-    def __init__(self, conn: asyncpg.Connection):
-        self.conn = conn
+    def __init__(self, pool: asyncpg.Pool):
+        """
+        Statements are sent as constant strings, so asyncpg prepares
+        each of them once per connection and reuses it from
+        its statement cache afterwards.
+        """
+        self.pool = pool
 
     async def close(self):
-        await self.conn.close()
+        await self.pool.close()
 
-    async def insert_user(
-            self, yandex_id: int,
-            token: str,
-            refresh_token: str,
-            token_due_date: date) -> None:
-        try:
-            await self.conn.execute("""
-                INSERT INTO users (id, token, refresh_token, token_due_date)
-                    VALUES ($1, $2, $3, $4);
-            """, yandex_id, token, refresh_token, token_due_date)
-        except asyncpg.exceptions.UniqueViolationError:
-            raise UserAlreadyExists("User with this id already exists.")
-        except asyncpg.StringDataRightTruncationError:
-            raise StringTooLong("String is too long.")
+    def pool_stats(self) -> dict[str, int]:
+        return {
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size()
+        }
 
-    async def user_exists(self, yandex_id: int) -> bool:
-        return bool(await self.conn.fetchval("""
-            SELECT count(*)
-            FROM users
-            WHERE id = $1;
-        """, yandex_id))
+    @timed("postgres")
+    async def migrate(self, migrations: list[str]) -> list[int]:
+        """
+        Apply migrations which were not applied yet, each of them
+        in its own transaction. Processes migrating at once wait
+        for each other on advisory lock, so every migration runs once.
+        :param migrations: list of SQL scripts, version of script
+        is its position in list starting from 1
+        :return: versions of applied migrations
+        """
+        applied = []
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "SELECT pg_advisory_lock($1, 0);", MIGRATIONS_LOCK
+            )
+            try:
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version     INT PRIMARY KEY,
+                        applied_at  TIMESTAMP NOT NULL DEFAULT now()
+                    );
+                """)
+                current = await conn.fetchval("""
+                    SELECT coalesce(max(version), 0)
+                    FROM schema_migrations;
+                """)
+                for version, migration in enumerate(migrations, 1):
+                    if version <= current:
+                        continue
+                    async with conn.transaction():
+                        await conn.execute(migration)
+                        await conn.execute("""
+                            INSERT INTO schema_migrations (version)
+                            VALUES ($1);
+                        """, version)
+                    applied.append(version)
+            finally:
+                await conn.execute(
+                    "SELECT pg_advisory_unlock($1, 0);", MIGRATIONS_LOCK
+                )
+        return applied
+
+    @asynccontextmanager
+    async def syncer_leadership(self, shard: int, retry: float):
+        """
+        Wait until this process becomes leader of shard and hold
+        leadership while in context. Leadership is session advisory
+        lock on dedicated connection, so it is released as soon as
+        connection of dead leader is closed, and waiting process takes
+        it over within *retry* seconds.
+        :param shard: number of syncer shard
+        :param retry: seconds between attempts to take leadership
+        :return: connection holding the lock, leadership is lost
+        when it is closed
+        """
+        async with self.pool.acquire() as conn:
+            while not await conn.fetchval(
+                    "SELECT pg_try_advisory_lock($1, $2);",
+                    SYNCER_LOCK, shard):
+                await asyncio.sleep(retry)
+            try:
+                yield conn
+            finally:
+                if not conn.is_closed():
+                    await conn.execute(
+                        "SELECT pg_advisory_unlock($1, $2);",
+                        SYNCER_LOCK, shard
+                    )
+
+    @timed("postgres")
+    async def get_syncer_leaders(self) -> list[dict[str, str]]:
+        """
+        :return: shards which have leader with address
+        of leader and time its connection was opened
+        """
+        res = await self.pool.fetch("""
+            SELECT l.objid AS shard, a.client_addr, a.backend_start
+            FROM pg_locks l
+                JOIN pg_stat_activity a USING (pid)
+            WHERE l.locktype = 'advisory' AND l.classid = $1
+                AND l.objsubid = 2 AND l.granted
+            ORDER BY l.objid;
+        """, SYNCER_LOCK)
+        return [{
+            "shard": record["shard"],
+            "address": str(record["client_addr"] or "local"),
+            "since": record["backend_start"].isoformat()
+        } for record in res]
 
-    async def insert_odoo_instance(
+    @timed("postgres")
+    async def subscribe_odoo_instance(
             self, yandex_id: int,
+            token: str,
+            refresh_token: str,
+            token_due_date: datetime,
             instance_url: str,
             db_name: str,
             db_password: str,
-            cooldown: int) -> None:
+            cooldown: int,
+            backup_format: str,
+            backup_slot: int,
+            window_start: int | None,
+            window_end: int | None) -> None:
+        """
+        Upsert user with fresh tokens and their odoo instance
+        in one statement. Subscribing existing instance again replaces
+        its settings and makes it due at once, keeping info about
+        its last backup. Can raise *StringTooLong*.
+        :param backup_slot: minute of day to make backups at
+        :param window_start: first minute of maintenance window
+        :param window_end: minute after the end of maintenance window
+        """
         try:
-            await self.conn.execute("""
-                INSERT INTO odoo_instances 
-                    (owner, url, db_name, db_password, next_backup, cooldown)
-                VALUES($1, $2, $3, $4, current_date, $5);
-            """, yandex_id, instance_url, db_name, db_password, cooldown)
-        except asyncpg.ForeignKeyViolationError:
-            raise UserExistenceError("User with this id doesn't exist.")
-        except asyncpg.UniqueViolationError:
-            raise OdooInstanceAlreadyExistsError(
-                "Odoo instance with this owner, "
-                "url and database name already exists."
-            )
+            await self.pool.execute("""
+                WITH owner AS (
+                    INSERT INTO users (
+                        id, token, refresh_token, token_due_date
+                    )
+                    VALUES ($1, $2, $3, $4)
+                    ON CONFLICT (id) DO UPDATE
+                    SET token = EXCLUDED.token,
+                        refresh_token = EXCLUDED.refresh_token,
+                        token_due_date = EXCLUDED.token_due_date
+                )
+                INSERT INTO odoo_instances (
+                    owner, url, db_name, db_password, next_backup,
+                    cooldown, backup_format, backup_slot,
+                    window_start, window_end
+                )
+                VALUES ($1, $5, $6, $7, now(), $8, $9, $10, $11, $12)
+                ON CONFLICT (owner, url, db_name) DO UPDATE
+                SET db_password = EXCLUDED.db_password,
+                    next_backup = EXCLUDED.next_backup,
+                    cooldown = EXCLUDED.cooldown,
+                    backup_format = EXCLUDED.backup_format,
+                    backup_slot = EXCLUDED.backup_slot,
+                    window_start = EXCLUDED.window_start,
+                    window_end = EXCLUDED.window_end;
+            """, yandex_id, token, refresh_token, token_due_date,
+                instance_url, db_name, db_password, cooldown, backup_format,
+                backup_slot, window_start, window_end)
         except asyncpg.StringDataRightTruncationError:
             raise StringTooLong("String is too long.")
 
-    async def odoo_instance_exists(
+    @timed("postgres")
+    async def subscribe_odoo_instances(
             self, yandex_id: int,
-            url: str,
-            db_name: str) -> bool:
-        return bool(await self.conn.fetchval("""
-            SELECT count(*)
-            FROM odoo_instances
-            WHERE owner = $1 AND url = $2 AND db_name = $3;
-        """, yandex_id, url, db_name))
+            token: str,
+            refresh_token: str,
+            token_due_date: datetime,
+            instances: list[tuple]) -> None:
+        """
+        Upsert user with fresh tokens and many odoo instances
+        in one transaction. Instances are copied into temporary table
+        and upserted from it by one statement. Their first backups
+        are made at their slots, so they don't start at once.
+        :param instances: tuples of url, db_name, db_password,
+        cooldown, backup_format, backup_slot, window_start and
+        window_end, without repeated url and db_name
+        """
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("""
+                INSERT INTO users (id, token, refresh_token, token_due_date)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (id) DO UPDATE
+                SET token = EXCLUDED.token,
+                    refresh_token = EXCLUDED.refresh_token,
+                    token_due_date = EXCLUDED.token_due_date;
+            """, yandex_id, token, refresh_token, token_due_date)
+            await conn.execute("""
+                CREATE TEMPORARY TABLE bulk_instances (
+                    url             VARCHAR(140),
+                    db_name         VARCHAR(80),
+                    db_password     VARCHAR(80),
+                    cooldown        INT,
+                    backup_format   VARCHAR(10),
+                    backup_slot     INT,
+                    window_start    INT,
+                    window_end      INT
+                ) ON COMMIT DROP;
+            """)
+            await conn.copy_records_to_table(
+                "bulk_instances", records=instances
+            )
+            await conn.execute("""
+                INSERT INTO odoo_instances (
+                    owner, url, db_name, db_password, next_backup,
+                    cooldown, backup_format, backup_slot,
+                    window_start, window_end
+                )
+                SELECT $1, url, db_name, db_password,
+                    next_slot(now()::timestamp, backup_slot),
+                    cooldown, backup_format, backup_slot,
+                    window_start, window_end
+                FROM bulk_instances
+                ON CONFLICT (owner, url, db_name) DO UPDATE
+                SET db_password = EXCLUDED.db_password,
+                    next_backup = EXCLUDED.next_backup,
+                    cooldown = EXCLUDED.cooldown,
+                    backup_format = EXCLUDED.backup_format,
+                    backup_slot = EXCLUDED.backup_slot,
+                    window_start = EXCLUDED.window_start,
+                    window_end = EXCLUDED.window_end;
+            """, yandex_id)
 
+    @timed("postgres")
     async def get_instances_of_user(
             self, yandex_id: int) -> list[dict[str, str]]:
-        res = await self.conn.fetch("""
+        res = await self.pool.fetch("""
             SELECT url, db_name
             FROM odoo_instances
             WHERE owner = $1;
@@ -129,79 +278,562 @@ class Database:
             "db_name": record["db_name"]
         } for record in res]
 
+    @timed("postgres")
     async def delete_odoo_instance(
             self, yandex_id: int,
             instance_url: str,
-            db_name: str) -> None:
-        await self.conn.execute("""
+            db_name: str) -> bool:
+        """
+        :return: whether instance existed
+        """
+        status = await self.pool.execute("""
             DELETE
             FROM odoo_instances
             WHERE owner = $1 AND url = $2 AND db_name = $3;
         """, yandex_id, instance_url, db_name)
+        return status != "DELETE 0"
 
-    async def get_odoo_instances_to_backup(self) -> list[dict[str, str]]:
-        async with self.conn.transaction():
-            res = await self.conn.fetch("""
-                SELECT token, url, db_name, db_password
-                FROM odoo_instances oi LEFT JOIN users u ON u.id = oi.owner
-                WHERE next_backup <= current_date;
+    @timed("postgres")
+    async def enqueue_due_backups(self, max_attempts: int) -> None:
+        """
+        Create backup job for every odoo instance which is due,
+        at most one per instance a day. Jobs with expired lease which
+        have no attempts left are marked as failed. Runnable jobs
+        which missed maintenance window of their instance are put off
+        until the window opens again.
+        :param max_attempts: how many times job can be claimed
+        """
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("""
+                UPDATE backup_jobs
+                SET status = 'failed',
+                    locked_by = NULL,
+                    lease_expires = NULL,
+                    last_error = 'LeaseExpired'
+                WHERE status = 'running' AND lease_expires < now()
+                    AND attempts >= $1;
+            """, max_attempts)
+            await conn.execute("""
+                INSERT INTO backup_jobs (owner, url, db_name, scheduled_for)
+                SELECT owner, url, db_name, current_date
+                FROM odoo_instances
+                WHERE next_backup <= now()
+                ON CONFLICT DO NOTHING;
             """)
-            await self.conn.execute("""
-                UPDATE odoo_instances
-                SET next_backup = current_date + cooldown
-                WHERE next_backup <= current_date;
+            await conn.execute("""
+                UPDATE backup_jobs j
+                SET status = 'pending',
+                    locked_by = NULL,
+                    lease_expires = NULL,
+                    run_after = next_in_window(
+                        now()::timestamp, oi.window_start, oi.window_end
+                    )
+                FROM odoo_instances oi
+                WHERE oi.owner = j.owner AND oi.url = j.url
+                    AND oi.db_name = j.db_name
+                    AND (
+                        j.status = 'pending' AND j.run_after <= now()
+                        OR j.status = 'running' AND j.lease_expires < now()
+                    )
+                    AND NOT in_window(
+                        now()::timestamp, oi.window_start, oi.window_end
+                    );
             """)
+
+    @timed("postgres")
+    async def claim_backup_jobs(
+            self, worker_id: str,
+            limit: int,
+            lease_seconds: int,
+            max_attempts: int,
+            shard: int = 0,
+            shards: int = 1,
+            held: dict[str, int] | None = None,
+            host_limit: int | None = None) -> list[dict[str, str]]:
+        """
+        Lock up to *limit* runnable backup jobs for worker. Jobs locked
+        by other workers are skipped, jobs of dead workers are taken
+        over after their lease expires. Jobs are claimed only inside
+        maintenance window of their instance. Jobs are taken round-robin
+        by odoo hosts and then by owners, so many jobs of one host or
+        owner don't hold back the others.
+        :param worker_id: unique identifier of worker
+        :param limit: max count of jobs to claim
+        :param lease_seconds: for how long jobs are leased
+        :param max_attempts: how many times job can be claimed
+        :param shard: number of worker's shard, only jobs whose odoo
+        host hashes to it are claimed, so one host is always backed up
+        by the same worker
+        :param shards: count of shards
+        :param held: count of jobs worker already holds by odoo host
+        :param host_limit: max count of jobs worker holds for one host,
+        hosts which already have that many are skipped
+        :return: list of claimed jobs with credentials
+        """
+        held = held or {}
+        res = await self.pool.fetch("""
+            WITH candidates AS (
+                SELECT j.id, j.run_after,
+                    row_number() OVER (
+                        PARTITION BY split_part(j.url, '/', 3)
+                        ORDER BY j.run_after
+                    ) + coalesce(h.held, 0) AS host_turn,
+                    row_number() OVER (
+                        PARTITION BY j.owner ORDER BY j.run_after
+                    ) AS owner_turn
+                FROM backup_jobs j
+                    JOIN odoo_instances oi USING (owner, url, db_name)
+                    LEFT JOIN unnest($7::text[], $8::int[]) AS h(host, held)
+                        ON h.host = split_part(j.url, '/', 3)
+                WHERE j.attempts < $4 AND (
+                    j.status = 'pending' AND j.run_after <= now()
+                    OR j.status = 'running' AND j.lease_expires < now()
+                ) AND (hashtext(split_part(j.url, '/', 3)) & 2147483647)
+                    % $6 = $5
+                    AND in_window(
+                        now()::timestamp, oi.window_start, oi.window_end
+                    )
+            ), claimed AS (
+                UPDATE backup_jobs
+                SET status = 'running',
+                    locked_by = $1,
+                    lease_expires = now() + make_interval(secs => $3),
+                    attempts = attempts + 1
+                WHERE id IN (
+                    SELECT j.id
+                    FROM backup_jobs j
+                        JOIN candidates c USING (id)
+                    WHERE j.attempts < $4 AND (
+                        j.status = 'pending' AND j.run_after <= now()
+                        OR j.status = 'running' AND j.lease_expires < now()
+                    ) AND ($9::int IS NULL OR c.host_turn <= $9)
+                    ORDER BY c.host_turn, c.owner_turn, c.run_after
+                    LIMIT $2
+                    FOR UPDATE OF j SKIP LOCKED
+                )
+                RETURNING id, owner, url, db_name
+            )
+            SELECT c.id, c.owner, u.token, c.url, c.db_name, oi.db_password,
+                oi.last_backup_hash, oi.last_backup_path, oi.backup_format,
+                oi.min_bytes_per_second, oi.first_byte_timeout
+            FROM claimed c
+                JOIN odoo_instances oi USING (owner, url, db_name)
+                JOIN users u ON u.id = c.owner;
+        """, worker_id, limit, lease_seconds, max_attempts, shard, shards,
+            list(held), list(held.values()), host_limit)
         return [{
+            "id": record["id"],
+            "owner": record["owner"],
             "token": record["token"],
             "url": record["url"],
             "db_name": record["db_name"],
-            "db_password": record["db_password"]
+            "db_password": record["db_password"],
+            "last_backup_hash": record["last_backup_hash"],
+            "last_backup_path": record["last_backup_path"],
+            "backup_format": record["backup_format"],
+            "min_bytes_per_second": record["min_bytes_per_second"],
+            "first_byte_timeout": record["first_byte_timeout"]
+        } for record in res]
+
+    @timed("postgres")
+    async def extend_backup_leases(
+            self, worker_id: str,
+            lease_seconds: int) -> None:
+        await self.pool.execute("""
+            UPDATE backup_jobs
+            SET lease_expires = now() + make_interval(secs => $2)
+            WHERE status = 'running' AND locked_by = $1;
+        """, worker_id, lease_seconds)
+
+    @timed("postgres")
+    async def complete_backup_job(
+            self, job_id: int,
+            worker_id: str,
+            backup_hash: str | None,
+            backup_size: int | None,
+            backup_path: str) -> None:
+        """
+        Mark job as done, move next backup of its instance
+        to its slot after cooldown and remember what was uploaded.
+        :param job_id: id of backup job
+        :param worker_id: unique identifier of worker holding the job
+        :param backup_hash: digest of backup
+        :param backup_size: size of backup in bytes
+        :param backup_path: name of backup in application folder
+        """
+        await self.pool.execute("""
+            WITH done AS (
+                UPDATE backup_jobs
+                SET status = 'done', locked_by = NULL, lease_expires = NULL
+                WHERE id = $1 AND locked_by = $2 AND status = 'running'
+                RETURNING owner, url, db_name
+            )
+            UPDATE odoo_instances oi
+            SET next_backup = date_trunc(
+                    'day', now() + make_interval(days => cooldown)
+                ) + make_interval(mins => backup_slot),
+                last_backup_hash = $3,
+                last_backup_size = $4,
+                last_backup_path = $5
+            FROM done
+            WHERE oi.owner = done.owner AND oi.url = done.url
+                AND oi.db_name = done.db_name;
+        """, job_id, worker_id, backup_hash, backup_size, backup_path)
+
+    @timed("postgres")
+    async def fail_backup_job(
+            self, job_id: int,
+            worker_id: str,
+            error: str,
+            retry_delay: int,
+            max_attempts: int) -> None:
+        """
+        Release failed job. It is retried after exponential backoff
+        until it has no attempts left, then it is marked as failed.
+        Retry falling out of maintenance window of instance is put off
+        until the window opens.
+        :param job_id: id of backup job
+        :param worker_id: unique identifier of worker holding the job
+        :param error: name of error which caused failure
+        :param retry_delay: delay before first retry in seconds
+        :param max_attempts: how many times job can be claimed
+        """
+        await self.pool.execute("""
+            UPDATE backup_jobs j
+            SET status = CASE
+                    WHEN attempts >= $5 THEN 'failed' ELSE 'pending'
+                END,
+                run_after = next_in_window(
+                    (now() + make_interval(
+                        secs => $4 * 2 ^ (attempts - 1)
+                    ))::timestamp,
+                    oi.window_start,
+                    oi.window_end
+                ),
+                locked_by = NULL,
+                lease_expires = NULL,
+                last_error = $3
+            FROM odoo_instances oi
+            WHERE oi.owner = j.owner AND oi.url = j.url
+                AND oi.db_name = j.db_name
+                AND j.id = $1 AND j.locked_by = $2 AND j.status = 'running';
+        """, job_id, worker_id, error, retry_delay, max_attempts)
+
+    @timed("postgres")
+    async def get_slot_inputs(self) -> list[dict[str, str]]:
+        res = await self.pool.fetch("""
+            SELECT owner, url, db_name, cooldown, last_backup_size,
+                window_start, window_end
+            FROM odoo_instances;
+        """)
+        return [{
+            "owner": record["owner"],
+            "url": record["url"],
+            "db_name": record["db_name"],
+            "cooldown": record["cooldown"],
+            "size": record["last_backup_size"],
+            "window_start": record["window_start"],
+            "window_end": record["window_end"]
         } for record in res]
 
-    async def get_tokens_to_refresh(self) -> list[dict[str, str]]:
-        res = await self.conn.fetch("""
+    @timed("postgres")
+    async def update_backup_slots(self, slots: list[tuple]) -> None:
+        """
+        Save new slots and move next backups which are not due yet
+        to new slot of the same day, or to the next one when it
+        has already passed.
+        :param slots: tuples of slot, owner, url and db_name
+        """
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("""
+                CREATE TEMPORARY TABLE new_slots (
+                    backup_slot     INT,
+                    owner           BIGINT,
+                    url             VARCHAR(140),
+                    db_name         VARCHAR(80)
+                ) ON COMMIT DROP;
+            """)
+            await conn.copy_records_to_table("new_slots", records=slots)
+            await conn.execute("""
+                UPDATE odoo_instances oi
+                SET backup_slot = ns.backup_slot,
+                    next_backup = CASE
+                        WHEN oi.next_backup <= now() THEN oi.next_backup
+                        ELSE next_slot(
+                            greatest(
+                                date_trunc('day', oi.next_backup),
+                                now()::timestamp
+                            ),
+                            ns.backup_slot
+                        )
+                    END
+                FROM new_slots ns
+                WHERE oi.owner = ns.owner AND oi.url = ns.url
+                    AND oi.db_name = ns.db_name
+                    AND oi.backup_slot <> ns.backup_slot;
+            """)
+
+    @timed("postgres")
+    async def insert_backup_runs(self, runs: list[tuple]) -> None:
+        """
+        Save many backup runs with one COPY.
+        :param runs: tuples of owner, url, db_name, started_at,
+        finished_at, size, download_seconds, recompress_seconds,
+        upload_seconds and error
+        """
+        await self.pool.copy_records_to_table(
+            "backup_runs",
+            records=runs,
+            columns=[
+                "owner", "url", "db_name", "started_at", "finished_at",
+                "size", "download_seconds", "recompress_seconds",
+                "upload_seconds", "error"
+            ]
+        )
+
+    @timed("postgres")
+    async def get_latest_runs(
+            self, yandex_id: int,
+            limit: int) -> list[dict[str, str]]:
+        """
+        :param yandex_id: id of instances owner
+        :param limit: max count of runs of every instance
+        :return: runs of every instance of user from the latest,
+        instance without runs is returned once with empty run fields
+        """
+        res = await self.pool.fetch("""
+            SELECT oi.url, oi.db_name, oi.next_backup,
+                r.started_at, r.finished_at, r.size,
+                r.size / nullif(extract(epoch FROM
+                    r.finished_at - r.started_at), 0)::float
+                    AS bytes_per_second,
+                r.download_seconds, r.recompress_seconds,
+                r.upload_seconds, r.error
+            FROM odoo_instances oi
+                LEFT JOIN LATERAL (
+                    SELECT *
+                    FROM backup_runs r
+                    WHERE r.owner = oi.owner AND r.url = oi.url
+                        AND r.db_name = oi.db_name
+                    ORDER BY r.started_at DESC
+                    LIMIT $2
+                ) r ON true
+            WHERE oi.owner = $1
+            ORDER BY oi.url, oi.db_name, r.started_at DESC;
+        """, yandex_id, limit)
+        return [dict(record) for record in res]
+
+    @timed("postgres")
+    async def chunk_exists(self, yandex_id: int, chunk_hash: str) -> bool:
+        return bool(await self.pool.fetchval("""
+            SELECT count(*)
+            FROM backup_chunks
+            WHERE owner = $1 AND hash = $2;
+        """, yandex_id, chunk_hash))
+
+    @timed("postgres")
+    async def insert_chunk(
+            self, yandex_id: int,
+            chunk_hash: str,
+            size: int) -> None:
+        await self.pool.execute("""
+            INSERT INTO backup_chunks (owner, hash, size)
+            VALUES ($1, $2, $3)
+            ON CONFLICT DO NOTHING;
+        """, yandex_id, chunk_hash, size)
+
+    async def iter_tokens_to_refresh(
+            self, batch_size: int,
+            shard: int = 0,
+            shards: int = 1) -> AsyncIterator[list[dict[str, str]]]:
+        """
+        Stream users whose tokens expire soon by batches ordered by id.
+        Every batch is read by its own query starting after the last
+        id of previous one, so no transaction is kept open while
+        tokens are refreshed and memory doesn't grow with count
+        of users.
+        :param batch_size: count of users in one batch
+        :param shard: only users whose id modulo *shards* is *shard*
+        are returned
+        :param shards: count of shards
+        :return: async iterator over batches of users
+        """
+        last_id = -1
+        while batch := await self.get_tokens_to_refresh(
+                last_id, batch_size, shard, shards):
+            yield batch
+            if len(batch) < batch_size:
+                break
+            last_id = batch[-1]["id"]
+
+    @timed("postgres")
+    async def get_tokens_to_refresh(
+            self, after_id: int,
+            limit: int,
+            shard: int,
+            shards: int) -> list[dict[str, str]]:
+        res = await self.pool.fetch("""
             SELECT id, refresh_token
             FROM users
-            WHERE current_date > users.token_due_date - 30;
-        """)
+            WHERE id > $1
+                AND token_due_date < now() + interval '30 days'
+                AND (next_refresh_attempt IS NULL
+                    OR next_refresh_attempt <= now())
+                AND id % $4 = $3
+            ORDER BY id
+            LIMIT $2;
+        """, after_id, limit, shard, shards)
         return [{
             "id": record["id"],
             "refresh_token": record["refresh_token"]
         } for record in res]
 
-    async def update_user_token(
-            self,
-            yandex_id: int,
-            new_token: str,
-            new_refresh_token: str,
-            new_due_date: date) -> None:
-        async with self.conn.transaction():
-            await self.conn.execute("""
-                UPDATE users
-                SET token_due_date = $2
-                WHERE id = $1;
-            """, yandex_id, new_due_date)
-            await self.conn.execute("""
-                UPDATE users as u SET
-                    token = nd.token,
-                    refresh_token = nd.refresh_token
-                FROM (VALUES
-                    ($1, $2, $3)
-                ) as nd(id, token, refresh_token)
-                WHERE u.id = nd.id;
-            """, yandex_id, new_token, new_refresh_token)
-
-
-class UserExistenceError(Exception):
-    pass
+    @timed("postgres")
+    async def count_due_backup_jobs(self) -> int:
+        return await self.pool.fetchval("""
+            SELECT count(*)
+            FROM backup_jobs
+            WHERE status = 'pending' AND run_after <= now();
+        """)
 
+    @timed("postgres")
+    async def get_token_refresh_lag(self) -> float:
+        """
+        :return: how many seconds ago the most overdue
+        token should have been refreshed, 0 if none is due
+        """
+        return await self.pool.fetchval("""
+            SELECT coalesce(
+                extract(epoch FROM now() + interval '30 days'
+                    - min(token_due_date))::float,
+                0
+            )
+            FROM users
+            WHERE token_due_date < now() + interval '30 days';
+        """)
 
-class OdooInstanceAlreadyExistsError(Exception):
-    pass
+    @timed("postgres")
+    async def get_seconds_to_wakeup(self) -> float | None:
+        """
+        Count how long syncer can sleep until some instance is due,
+        some backup job can be retried or taken over, or some token
+        needs refreshing. Tokens which failed to refresh are waited
+        for until their next attempt.
+        :return: count of seconds, negative if something is overdue,
+        None if there is nothing to wait for
+        """
+        return await self.pool.fetchval("""
+            SELECT extract(epoch FROM least(
+                (
+                    SELECT next_backup
+                    FROM odoo_instances oi
+                    WHERE NOT EXISTS (
+                        SELECT 1
+                        FROM backup_jobs j
+                        WHERE j.owner = oi.owner AND j.url = oi.url
+                            AND j.db_name = oi.db_name
+                            AND j.scheduled_for = current_date
+                    )
+                    ORDER BY next_backup
+                    LIMIT 1
+                ),
+                (
+                    SELECT min(greatest(oi.next_backup, current_date + 1))
+                    FROM backup_jobs j
+                        JOIN odoo_instances oi USING (owner, url, db_name)
+                    WHERE j.scheduled_for = current_date
+                ),
+                (
+                    SELECT min(run_after)
+                    FROM backup_jobs
+                    WHERE status = 'pending'
+                ),
+                (
+                    SELECT min(lease_expires)
+                    FROM backup_jobs
+                    WHERE status = 'running'
+                ),
+                (
+                    SELECT min(token_due_date) - interval '30 days'
+                    FROM users
+                    WHERE next_refresh_attempt IS NULL
+                ),
+                (
+                    SELECT min(next_refresh_attempt)
+                    FROM users
+                )
+            ) - now())::float;
+        """)
 
+    @asynccontextmanager
+    async def listen(self, channel: str, callback: Callable[[], None]):
+        """
+        Call *callback* on every notification in channel while
+        inside the context. Holds one connection of pool.
+        :param channel: name of postgres notification channel
+        :param callback: function without arguments
+        """
+        def listener(*args):
+            callback()
 
-class UserAlreadyExists(Exception):
-    pass
+        async with self.pool.acquire() as conn:
+            await conn.add_listener(channel, listener)
+            try:
+                yield
+            finally:
+                await conn.remove_listener(channel, listener)
+
+    @timed("postgres")
+    async def get_user_tokens(self, yandex_id: int) -> dict[str, str]:
+        record = await self.pool.fetchrow("""
+            SELECT token, refresh_token
+            FROM users
+            WHERE id = $1;
+        """, yandex_id)
+        return {
+            "token": record["token"],
+            "refresh_token": record["refresh_token"]
+        }
+
+    @timed("postgres")
+    async def update_user_tokens(self, tokens: list[dict]) -> None:
+        """
+        Save refreshed tokens of many users in one batch.
+        :param tokens: list of dicts with "id", "token",
+        "refresh_token" and "due_date" keys
+        """
+        await self.pool.executemany("""
+            UPDATE users
+            SET token = $2, refresh_token = $3, token_due_date = $4,
+                refresh_failures = 0, next_refresh_attempt = NULL
+            WHERE id = $1;
+        """, [(
+            user["id"],
+            user["token"],
+            user["refresh_token"],
+            user["due_date"]
+        ) for user in tokens])
+
+    @timed("postgres")
+    async def postpone_token_refresh(
+            self, yandex_ids: list[int],
+            retry_delay: int,
+            max_retry_delay: int) -> None:
+        """
+        Put off refreshing tokens of users whose refresh failed,
+        doubling the delay after every failure in a row.
+        :param yandex_ids: ids of users
+        :param retry_delay: seconds to wait after the first failure
+        :param max_retry_delay: max seconds to wait
+        """
+        await self.pool.execute("""
+            UPDATE users
+            SET refresh_failures = refresh_failures + 1,
+                next_refresh_attempt = now() + make_interval(secs => least(
+                    $2 * power(2, least(refresh_failures, 30)), $3
+                ))
+            WHERE id = ANY($1::bigint[]);
+        """, yandex_ids, retry_delay, max_retry_delay)
 
 
 class StringTooLong(Exception):
@@ -0,0 +1,223 @@
+"""
+Module with incremental backups: backup is split into content-defined
+chunks, only chunks which are not stored yet are uploaded, and every
+backup gets a manifest listing its chunks.
+"""
+import os
+import sys
+import json
+import asyncio
+import hashlib
+from typing import AsyncIterator
+from loguru import logger
+from database import Database
+from yandex import YandexDisk
+from http_clients import close_clients
+
+
+CHUNKS_FOLDER = "chunks"
+MANIFEST_SUFFIX = ".manifest.json"
+MIN_CHUNK_SIZE = 512 * 1024
+AVG_CHUNK_BITS = 21
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+ANCHOR = b"\x8c\x1f"
+
+
+class Chunker:
+    """
+    Splits stream into content-defined chunks, so an insertion shifts
+    only nearby chunk boundaries. Boundary is put after three byte
+    window which starts with ANCHOR and whose last byte has
+    *avg_bits* - 16 low bits unset. Windows are searched with
+    bytearray.find instead of byte by byte rolling hash, which is
+    about hundred times faster in python. Odoo zips are compressed,
+    so their bytes are close to uniform and average chunk size
+    is about 2 ** *avg_bits* bytes over *min_size*.
+    """
+    def __init__(
+            self, min_size: int = MIN_CHUNK_SIZE,
+            avg_bits: int = AVG_CHUNK_BITS,
+            max_size: int = MAX_CHUNK_SIZE):
+        self.min_size = min_size
+        self.mask = 2 ** (avg_bits - 8 * len(ANCHOR)) - 1
+        self.max_size = max_size
+        self.buffer = bytearray()
+        self.position = 0
+
+    def find_cut(self) -> int | None:
+        buffer = self.buffer
+        end = min(len(buffer), self.max_size)
+        i = max(self.position, self.min_size)
+        while (i := buffer.find(ANCHOR, i, end)) != -1:
+            if i + len(ANCHOR) >= end:
+                break
+            if not buffer[i + len(ANCHOR)] & self.mask:
+                return i + len(ANCHOR) + 1
+            i += 1
+        if end == self.max_size:
+            return end
+        self.position = max(end - len(ANCHOR), self.min_size)
+        return None
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+        :param data: next part of stream
+        :return: chunks completed by this part
+        """
+        self.buffer += data
+        chunks = []
+        while (cut := self.find_cut()) is not None:
+            chunks.append(bytes(self.buffer[:cut]))
+            del self.buffer[:cut]
+            self.position = 0
+        return chunks
+
+    def finish(self) -> bytes:
+        """
+        :return: the last chunk, which may be empty
+        """
+        chunk = bytes(self.buffer)
+        self.buffer.clear()
+        return chunk
+
+
+class ChunkStore:
+    def __init__(
+            self, db: Database,
+            disk: YandexDisk,
+            owner: int,
+            concurrency: int = 4):
+        """
+        :param db: database with index of uploaded chunks
+        :param disk: yandex disk of owner
+        :param owner: id of user owning chunks
+        :param concurrency: max count of chunks uploaded at once
+        """
+        self.db = db
+        self.disk = disk
+        self.owner = owner
+        self.concurrency = concurrency
+        self.uploads = asyncio.Semaphore(concurrency)
+
+    async def put_chunk(self, chunk_hash: str, chunk: bytes) -> None:
+        """
+        Upload chunk unless it is in index. Chunk is uploaded with
+        overwrite, because it can be on disk without index row after
+        interrupted upload or be uploaded by parallel task, and chunks
+        with the same name have the same content.
+        """
+        async with self.uploads:
+            if await self.db.chunk_exists(self.owner, chunk_hash):
+                return
+            await self.disk.put_file(
+                f"{CHUNKS_FOLDER}/{chunk_hash}", chunk, overwrite=True
+            )
+            await self.db.insert_chunk(self.owner, chunk_hash, len(chunk))
+
+    async def put_backup(
+            self, filename: str,
+            file: AsyncIterator[bytes]) -> tuple[str, int]:
+        """
+        Upload new chunks of backup and its manifest.
+        Can raise *YandexResponseError* and *WrongTokenError*.
+        :param filename: name of backup, manifest is named after it
+        :param file: async iterator over content of backup
+        :return: digest and size of whole backup
+        """
+        await self.disk.create_folder(CHUNKS_FOLDER)
+        chunker = Chunker()
+        sha256 = hashlib.sha256()
+        size = 0
+        manifest = []
+        uploads = set()
+
+        async def put(chunk: bytes) -> None:
+            chunk_hash = hashlib.sha256(chunk).hexdigest()
+            manifest.append([chunk_hash, len(chunk)])
+            uploads.add(asyncio.create_task(self.put_chunk(chunk_hash, chunk)))
+            if len(uploads) >= self.concurrency * 2:
+                done, _ = await asyncio.wait(
+                    uploads, return_when=asyncio.FIRST_COMPLETED
+                )
+                uploads.difference_update(done)
+                for task in done:
+                    task.result()
+
+        try:
+            async for data in file:
+                sha256.update(data)
+                size += len(data)
+                for chunk in await asyncio.to_thread(chunker.feed, data):
+                    await put(chunk)
+            if tail := chunker.finish():
+                await put(tail)
+            for task in asyncio.as_completed(uploads):
+                await task
+        finally:
+            for task in uploads:
+                task.cancel()
+        await self.disk.put_file(
+            f"{filename}{MANIFEST_SUFFIX}",
+            json.dumps({
+                "filename": filename,
+                "size": size,
+                "sha256": sha256.hexdigest(),
+                "chunks": manifest
+            }).encode()
+        )
+        return sha256.hexdigest(), size
+
+
+async def restore_backup(
+        disk: YandexDisk,
+        manifest_name: str,
+        path: str) -> None:
+    """
+    Reassemble backup from its manifest and chunks, checking hash
+    of every chunk and of the whole backup.
+    Can raise *YandexResponseError* and *CorruptedBackupError*.
+    :param disk: yandex disk of backup owner
+    :param manifest_name: name of manifest in application folder
+    :param path: where to write restored backup
+    """
+    manifest = json.loads(b"".join([
+        data async for data in disk.stream_file(manifest_name)
+    ]))
+    sha256 = hashlib.sha256()
+    with open(path, "wb") as output:
+        for chunk_hash, chunk_size in manifest["chunks"]:
+            chunk = b"".join([
+                data async for data in
+                disk.stream_file(f"{CHUNKS_FOLDER}/{chunk_hash}")
+            ])
+            if len(chunk) != chunk_size \
+                    or hashlib.sha256(chunk).hexdigest() != chunk_hash:
+                raise CorruptedBackupError(f"Chunk {chunk_hash} is damaged.")
+            sha256.update(chunk)
+            await asyncio.to_thread(output.write, chunk)
+    if sha256.hexdigest() != manifest["sha256"]:
+        raise CorruptedBackupError("Restored backup doesn't match manifest.")
+    logger.info(f"{manifest['filename']} was restored to {path}")
+
+
+class CorruptedBackupError(Exception):
+    pass
+
+
+async def main(manifest_name: str, path: str) -> None:
+    try:
+        await restore_backup(
+            YandexDisk(os.environ["YANDEX_TOKEN"]),
+            manifest_name,
+            path
+        )
+    finally:
+        await close_clients()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python dedup.py MANIFEST_NAME OUTPUT_PATH "
+              "(token is read from YANDEX_TOKEN)")
+        sys.exit(1)
+    asyncio.run(main(sys.argv[1], sys.argv[2]))
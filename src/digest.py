@@ -0,0 +1,60 @@
+"""
+Module with hashing of backups, used to detect unchanged ones.
+"""
+import asyncio
+import hashlib
+import zipfile
+from contextlib import aclosing
+from typing import AsyncIterator
+
+
+class StreamDigest:
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    async def wrap(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        Pass chunks through, hashing them on the way. Hashing runs
+        in thread, as hashlib releases GIL for big buffers.
+        Chunks are closed when wrapper is closed.
+        :param chunks: async generator over content of file
+        :return: the same chunks
+        """
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                await asyncio.to_thread(self.sha256.update, chunk)
+                self.size += len(chunk)
+                yield chunk
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+
+def zip_content_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Hash names, sizes and decompressed content of zip members,
+    ignoring their timestamps, so two dumps with the same content
+    get the same digest even though zip containers differ.
+    Content is hashed instead of trusting CRC32, which can collide.
+    Can raise *zipfile.BadZipFile*.
+    :param path: path to zip file
+    :param chunk_size: size of decompressed pieces hashed at once
+    :return: hex digest
+    """
+    sha256 = hashlib.sha256()
+    with zipfile.ZipFile(path) as archive:
+        for info in sorted(archive.infolist(), key=lambda i: i.filename):
+            sha256.update(f"{info.filename}\0{info.file_size}\n".encode())
+            with archive.open(info) as member:
+                while chunk := member.read(chunk_size):
+                    sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            sha256.update(chunk)
+    return sha256.hexdigest()
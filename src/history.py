@@ -0,0 +1,49 @@
+"""
+Module collecting history of backup runs and saving it in batches.
+"""
+import os
+from datetime import datetime
+from database import Database
+
+
+BACKUP_RUNS_BATCH = int(os.getenv("BACKUP_RUNS_BATCH", "50"))
+STAGES = ("download", "recompress", "upload")
+
+
+class RunHistory:
+    def __init__(self, db: Database, batch_size: int = BACKUP_RUNS_BATCH):
+        """
+        :param db: database to save runs to
+        :param batch_size: count of runs saved at once
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.runs: list[tuple] = []
+
+    async def record(
+            self, job: dict,
+            report: dict,
+            started_at: datetime,
+            finished_at: datetime) -> None:
+        """
+        Buffer run of backup job, saving buffer when it is full.
+        :param job: claimed job with "owner", "url" and "db_name"
+        :param report: report returned by backup_odoo_instance
+        """
+        self.runs.append((
+            job["owner"],
+            job["url"],
+            job["db_name"],
+            started_at,
+            finished_at,
+            report["size"],
+            *(report["stages"].get(stage) for stage in STAGES),
+            report["error"]
+        ))
+        if len(self.runs) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        runs, self.runs = self.runs, []
+        if runs:
+            await self.db.insert_backup_runs(runs)
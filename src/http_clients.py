@@ -0,0 +1,43 @@
+"""
+Module with process-wide registry of http clients,
+so connections to every host are kept alive and reused.
+"""
+import os
+from urllib.parse import urlparse
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+
+LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("HTTP_HOST_MAX_CONNECTIONS", "20")),
+    max_keepalive_connections=int(os.getenv("HTTP_HOST_KEEPALIVE", "10")),
+    keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+)
+
+clients: dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """
+    Get shared client for host of url. Every host has its own client,
+    so pool limits are applied per host. HTTP/2 is used when
+    *h2* package is installed.
+    :param url: any url on the host
+    :return: client for the host
+    """
+    parsed = urlparse(url)
+    origin = f"{parsed.scheme}://{parsed.netloc}"
+    if origin not in clients:
+        clients[origin] = httpx.AsyncClient(http2=HTTP2, limits=LIMITS)
+    return clients[origin]
+
+
+async def close_clients() -> None:
+    while clients:
+        _, client = clients.popitem()
+        await client.aclose()
@@ -0,0 +1,51 @@
+"""
+Module configuring log sinks of process. Records are written as JSON
+lines by background thread of loguru, so slow log volume doesn't lag
+event loop of API or syncer.
+"""
+import os
+import sys
+from loguru import logger
+
+
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_ROTATION = os.getenv("LOG_ROTATION", "100 MB")
+LOG_BUFFER_BYTES = int(os.getenv("LOG_BUFFER_BYTES", str(64 * 1024)))
+
+
+def setup_logging(name: str) -> None:
+    """
+    Replace sinks of process with enqueued ones. Info log is written
+    with buffer of LOG_BUFFER_BYTES, so lines reach disk in batches,
+    errors are written line by line.
+    Backup jobs log with "job_id" in extra, so one run can be found
+    across all its stages.
+    :param name: name of process, files are named after it,
+    so processes never write into the same file
+    """
+    logger.remove()
+    logger.add(sys.stderr, level="INFO", enqueue=True)
+    logger.add(
+        os.path.join(LOG_DIR, f"{name}.log"),
+        rotation=LOG_ROTATION,
+        level="INFO",
+        enqueue=True,
+        serialize=True,
+        buffering=LOG_BUFFER_BYTES
+    )
+    logger.add(
+        os.path.join(LOG_DIR, f"{name}.errors.log"),
+        rotation=LOG_ROTATION,
+        level="ERROR",
+        enqueue=True,
+        serialize=True
+    )
+
+
+def shutdown_logging() -> None:
+    """
+    Drain queues of sinks and close them, so buffered info lines
+    reach disk before process exits.
+    """
+    logger.complete()
+    logger.remove()
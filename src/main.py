@@ -1,39 +1,126 @@
 import os
-from multiprocessing import Process
+import time
+import asyncio
+import tempfile
 from dotenv import load_dotenv
 load_dotenv()
+if __name__ == "__main__":
+    # Set before prometheus_client is imported, so that API workers,
+    # syncer workers and supervisor share metrics through files.
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = \
+            tempfile.mkdtemp(prefix="metrics-")
+    METRICS_DIR = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith(".db"):
+            os.remove(os.path.join(METRICS_DIR, name))
 from loguru import logger
-logger.add("logs/logs.log", rotation="100 MB", level="INFO")
-logger.add("logs/errors.log", rotation="100 MB", level="ERROR")
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST
 import uvicorn
 import auth
-import syncer
 import authorized_routers
 import unauthorized_routers
 from database import Database
+from cache import Cache
+from http_clients import close_clients
+from supervisor import Supervisor
+from log_config import setup_logging, shutdown_logging
+from migrations import MIGRATIONS
+from metrics import HTTP_REQUEST_SECONDS, generate_metrics
 
 
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
 app = FastAPI()
 
 
 @app.on_event("startup")
 async def start():
-    await Database.create_tables(
-        os.environ["PG_HOST"],
-        int(os.environ["PG_PORT"]),
-        os.environ["PG_USER"],
-        os.environ["PG_PASSWORD"],
-        os.environ["PG_DATABASE"]
+    setup_logging("api" if API_WORKERS == 1 else f"api-{os.getpid()}")
+    app.state.db = await Database.connect(
+        host=os.environ["PG_HOST"],
+        port=int(os.environ["PG_PORT"]),
+        username=os.environ["PG_USER"],
+        password=os.environ["PG_PASSWORD"],
+        database=os.environ["PG_DATABASE"],
+        min_size=int(os.getenv("PG_POOL_MIN_SIZE", "2")),
+        max_size=int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+    )
+    app.state.cache = Cache(
+        os.environ["REDIS_CONNSTRING"],
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
     )
 
 
+@app.on_event("shutdown")
+async def stop():
+    await app.state.db.close()
+    await app.state.cache.close()
+    await close_clients()
+    if API_WORKERS > 1:
+        shutdown_logging()
+
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.url.path if "endpoint" in request.scope else "unmatched"
+    HTTP_REQUEST_SECONDS.labels(
+        request.method, route, response.status_code
+    ).observe(time.perf_counter() - start)
+    return response
+
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "database": app.state.db.pool_stats(),
+        "syncers": await app.state.db.get_syncer_leaders()
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(generate_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
 app.include_router(auth.router)
 app.include_router(authorized_routers.router)
 app.include_router(unauthorized_routers.router)
 
 
+async def migrate():
+    db = await Database.connect(
+        host=os.environ["PG_HOST"],
+        port=int(os.environ["PG_PORT"]),
+        username=os.environ["PG_USER"],
+        password=os.environ["PG_PASSWORD"],
+        database=os.environ["PG_DATABASE"],
+        min_size=1,
+        max_size=1
+    )
+    try:
+        if applied := await db.migrate(MIGRATIONS):
+            logger.info(f"Applied migrations {applied}.")
+    finally:
+        await db.close()
+
+
 if __name__ == "__main__":
-    Process(target=syncer.main).start()
-    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8000")))
+    setup_logging("api" if API_WORKERS == 1 else "main")
+    asyncio.run(migrate())
+    supervisor = Supervisor.from_env()
+    supervisor.start()
+    try:
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=int(os.getenv("PORT", "8000")),
+            workers=API_WORKERS
+        )
+    finally:
+        supervisor.stop()
+        shutdown_logging()
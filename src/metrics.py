@@ -0,0 +1,146 @@
+"""
+Module with prometheus metrics of API, syncer and backup stages.
+"""
+import os
+import time
+import functools
+from contextlib import aclosing
+from typing import AsyncIterator
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+
+
+SIZE_BUCKETS = [2 ** power for power in range(20, 41, 2)]
+SPEED_BUCKETS = [2 ** power for power in range(16, 31, 2)]
+STAGE_BUCKETS = [1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200, 14400]
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds",
+    "Latency of API requests.",
+    ["method", "route", "status"]
+)
+CALL_SECONDS = Histogram(
+    "external_call_seconds",
+    "Latency of calls to postgres, redis and yandex.",
+    ["service", "operation"]
+)
+ODOO_DOWNLOAD_SECONDS = Histogram(
+    "odoo_download_seconds",
+    "Time from requesting backup from odoo until it was read.",
+    ["host"],
+    buckets=STAGE_BUCKETS
+)
+YANDEX_UPLOAD_SECONDS = Histogram(
+    "yandex_upload_seconds",
+    "Time of uploading backup to yandex disk.",
+    buckets=STAGE_BUCKETS
+)
+BACKUP_SECONDS = Histogram(
+    "backup_seconds",
+    "Total time of backup.",
+    ["result"],
+    buckets=STAGE_BUCKETS
+)
+BACKUP_BYTES_PER_SECOND = Histogram(
+    "backup_bytes_per_second",
+    "Throughput of backup from odoo to yandex disk.",
+    ["host"],
+    buckets=SPEED_BUCKETS
+)
+BACKUP_SIZE_BYTES = Histogram(
+    "backup_size_bytes",
+    "Size of backup.",
+    buckets=SIZE_BUCKETS
+)
+BACKUP_ERRORS = Counter(
+    "backup_errors",
+    "Failed backups by error class.",
+    ["error"]
+)
+BACKUPS_IN_FLIGHT = Gauge(
+    "backups_in_flight",
+    "Backups being made at the moment.",
+    multiprocess_mode="livesum"
+)
+BACKUP_JOBS_DUE = Gauge(
+    "backup_jobs_due",
+    "Backup jobs which are due but not started.",
+    multiprocess_mode="livemax"
+)
+TOKEN_REFRESH_LAG_SECONDS = Gauge(
+    "token_refresh_lag_seconds",
+    "How long the most overdue token is waiting for refresh.",
+    multiprocess_mode="livemax"
+)
+SYNCER_WORKER_UP = Gauge(
+    "syncer_worker_up",
+    "Whether syncer worker of shard is alive.",
+    ["shard"],
+    multiprocess_mode="livemax"
+)
+SYNCER_WORKER_RESTARTS = Counter(
+    "syncer_worker_restarts",
+    "Restarts of syncer worker of shard after it exited.",
+    ["shard"]
+)
+
+
+def generate_metrics() -> bytes:
+    """
+    Metrics of all processes of service when PROMETHEUS_MULTIPROC_DIR
+    is set, otherwise of this process only.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Drop live gauges of exited process in multiprocess mode.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
+
+
+def timed(service: str):
+    """
+    Decorator observing latency of coroutine function
+    in CALL_SECONDS under its name.
+    :param service: name of called service
+    """
+    def decorator(func):
+        histogram = CALL_SECONDS.labels(service, func.__name__)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+async def timed_stream(
+        chunks: AsyncIterator[bytes],
+        histogram: Histogram) -> AsyncIterator[bytes]:
+    """
+    Pass chunks through, observing time from the first
+    request of chunk until stream is exhausted.
+    Chunks are closed when wrapper is closed.
+    """
+    start = time.perf_counter()
+    async with aclosing(chunks):
+        async for chunk in chunks:
+            yield chunk
+    histogram.observe(time.perf_counter() - start)
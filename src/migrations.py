@@ -0,0 +1,171 @@
+"""
+Module with versioned migrations of database schema. Version of
+migration is its position in MIGRATIONS starting from 1, so new
+migrations are only appended. Every migration is idempotent, so
+databases created by create_tables of earlier releases are migrated
+from the first version too.
+"""
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id              BIGINT PRIMARY KEY,
+        token           VARCHAR(120) NOT NULL,
+        refresh_token   VARCHAR(120) NOT NULL,
+        token_due_date  DATE NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS odoo_instances (
+        owner           BIGINT REFERENCES users(id)
+            ON UPDATE CASCADE ON DELETE CASCADE,
+        url             VARCHAR(140),
+        db_name         VARCHAR(80),
+        db_password     VARCHAR(80) NOT NULL,
+        next_backup     DATE NOT NULL,
+        cooldown        INT NOT NULL,
+        PRIMARY KEY (owner, url, db_name)
+    );
+    """,
+    """
+    ALTER TABLE users ALTER COLUMN token_due_date TYPE TIMESTAMP;
+    ALTER TABLE odoo_instances ALTER COLUMN next_backup TYPE TIMESTAMP;
+
+    CREATE TABLE IF NOT EXISTS backup_jobs (
+        id              BIGSERIAL PRIMARY KEY,
+        owner           BIGINT NOT NULL,
+        url             VARCHAR(140) NOT NULL,
+        db_name         VARCHAR(80) NOT NULL,
+        scheduled_for   DATE NOT NULL,
+        status          VARCHAR(10) NOT NULL DEFAULT 'pending',
+        attempts        INT NOT NULL DEFAULT 0,
+        run_after       TIMESTAMP NOT NULL DEFAULT now(),
+        locked_by       VARCHAR(120),
+        lease_expires   TIMESTAMP,
+        last_error      VARCHAR(80),
+        FOREIGN KEY (owner, url, db_name) REFERENCES odoo_instances
+            ON UPDATE CASCADE ON DELETE CASCADE,
+        UNIQUE (owner, url, db_name, scheduled_for)
+    );
+    """,
+    """
+    CREATE OR REPLACE FUNCTION notify_instances_changed()
+        RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('odoo_instances_changed', '');
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE TRIGGER odoo_instances_changed
+        AFTER INSERT ON odoo_instances
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_instances_changed();
+    """,
+    """
+    ALTER TABLE odoo_instances
+        ADD COLUMN IF NOT EXISTS last_backup_hash VARCHAR(64),
+        ADD COLUMN IF NOT EXISTS last_backup_size BIGINT,
+        ADD COLUMN IF NOT EXISTS last_backup_path VARCHAR(300);
+
+    CREATE TABLE IF NOT EXISTS backup_chunks (
+        owner           BIGINT REFERENCES users(id)
+            ON UPDATE CASCADE ON DELETE CASCADE,
+        hash            CHAR(64),
+        size            INT NOT NULL,
+        PRIMARY KEY (owner, hash)
+    );
+    """,
+    """
+    ALTER TABLE odoo_instances
+        ADD COLUMN IF NOT EXISTS backup_format VARCHAR(10)
+            NOT NULL DEFAULT 'zip';
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS users_token_due_date
+        ON users (token_due_date);
+    CREATE INDEX IF NOT EXISTS odoo_instances_next_backup
+        ON odoo_instances (next_backup);
+    CREATE INDEX IF NOT EXISTS backup_jobs_pending
+        ON backup_jobs (run_after) WHERE status = 'pending';
+    CREATE INDEX IF NOT EXISTS backup_jobs_running
+        ON backup_jobs (lease_expires) WHERE status = 'running';
+    CREATE INDEX IF NOT EXISTS backup_jobs_scheduled_for
+        ON backup_jobs (scheduled_for);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS backup_runs (
+        id                  BIGSERIAL PRIMARY KEY,
+        owner               BIGINT NOT NULL,
+        url                 VARCHAR(140) NOT NULL,
+        db_name             VARCHAR(80) NOT NULL,
+        started_at          TIMESTAMP NOT NULL,
+        finished_at         TIMESTAMP NOT NULL,
+        size                BIGINT,
+        download_seconds    REAL,
+        recompress_seconds  REAL,
+        upload_seconds      REAL,
+        error               VARCHAR(80)
+    );
+
+    CREATE INDEX IF NOT EXISTS backup_runs_latest
+        ON backup_runs (owner, url, db_name, started_at DESC);
+    """,
+    """
+    ALTER TABLE odoo_instances
+        ADD COLUMN IF NOT EXISTS backup_slot INT NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS window_start INT,
+        ADD COLUMN IF NOT EXISTS window_end INT;
+
+    UPDATE odoo_instances
+    SET backup_slot = (hashtext(owner || '/' || url || '/' || db_name)
+        & 2147483647) % 1440;
+
+    CREATE OR REPLACE FUNCTION next_slot(after TIMESTAMP, slot INT)
+        RETURNS TIMESTAMP AS $$
+    SELECT date_trunc('day', after) + make_interval(mins => slot)
+        + CASE
+            WHEN date_trunc('day', after) + make_interval(mins => slot)
+                < after THEN interval '1 day'
+            ELSE interval '0'
+        END;
+    $$ LANGUAGE sql IMMUTABLE;
+    """,
+    """
+    ALTER TABLE odoo_instances
+        ADD COLUMN IF NOT EXISTS min_bytes_per_second INT,
+        ADD COLUMN IF NOT EXISTS first_byte_timeout INT;
+    """,
+    """
+    ALTER TABLE users
+        ADD COLUMN IF NOT EXISTS refresh_failures INT NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS next_refresh_attempt TIMESTAMP;
+
+    CREATE INDEX IF NOT EXISTS users_token_due_date_not_failed
+        ON users (token_due_date) WHERE next_refresh_attempt IS NULL;
+    CREATE INDEX IF NOT EXISTS users_next_refresh_attempt
+        ON users (next_refresh_attempt);
+    """,
+    """
+    CREATE OR REPLACE FUNCTION in_window(
+            at TIMESTAMP, window_start INT, window_end INT)
+        RETURNS BOOLEAN AS $$
+    SELECT window_start IS NULL OR window_start = window_end
+        OR CASE
+            WHEN window_start < window_end
+                THEN minute >= window_start AND minute < window_end
+            ELSE minute >= window_start OR minute < window_end
+        END
+    FROM (
+        SELECT (extract(hour FROM at) * 60
+            + extract(minute FROM at))::int AS minute
+    ) at_minute;
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE OR REPLACE FUNCTION next_in_window(
+            after TIMESTAMP, window_start INT, window_end INT)
+        RETURNS TIMESTAMP AS $$
+    SELECT CASE
+        WHEN in_window(after, window_start, window_end) THEN after
+        ELSE next_slot(after, window_start)
+    END;
+    $$ LANGUAGE sql IMMUTABLE;
+    """
+]
@@ -1,28 +1,45 @@
+from typing import AsyncIterator
 from loguru import logger
 import httpx
+from http_clients import get_client
 
 
-async def get_odoo_backup(
+CHUNK_SIZE = 1024 * 1024
+
+
+async def stream_odoo_backup(
         manager_link: str,
         db_name: str,
-        password: str) -> bytes:
+        password: str,
+        chunk_size: int | None = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """
+    Stream zip backup of odoo database by chunks, so the whole
+    archive is never held in memory.
+    Can raise *OdooRequestError* while iterating.
+    :param manager_link: link to odoo database manager
+    :param db_name: name of odoo database to back up
+    :param password: master password of odoo
+    :param chunk_size: max size of one yielded chunk in bytes,
+    None yields chunks as they are read from network
+    :return: async iterator over chunks of backup
+    """
     backup_link = manager_link.replace("manager", "backup")
     try:
-        async with httpx.AsyncClient() as cl:
-            res = await cl.post(
+        async with get_client(backup_link).stream(
+                "POST",
                 backup_link,
                 data={
                     "master_pwd": password,
                     "name": db_name,
                     "backup_format": "zip"
                 },
-                timeout=None
-            )
+                timeout=None) as res:
             res.raise_for_status()
+            async for chunk in res.aiter_bytes(chunk_size):
+                yield chunk
     except httpx.HTTPError as err:
         logger.error(f"Error occurred while downloading backup - {str(err)}")
         raise OdooRequestError("Error while downloading backup.")
-    return res.content
 
 
 class OdooRequestError(Exception):
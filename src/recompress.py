@@ -0,0 +1,88 @@
+"""
+Module recompressing odoo zip backups into zstd compressed tar.
+Compression runs in pool of processes, so it doesn't stall
+event loop which drives other backups.
+"""
+import os
+import asyncio
+import tarfile
+import zipfile
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "10"))
+RECOMPRESS_WORKERS = int(os.getenv("RECOMPRESS_WORKERS", "2"))
+FORMATS = {"zip": ".zip", "zst": ".tar.zst"}
+
+executor: ProcessPoolExecutor | None = None
+
+
+def recompress_zip(zip_path: str, output_path: str, level: int) -> None:
+    """
+    Unpack zip by members and write them into tar stream compressed
+    with zstd, keeping names and modification times.
+    :param zip_path: path to odoo zip backup
+    :param output_path: path to resulting .tar.zst file
+    :param level: zstd compression level
+    """
+    compressor = zstandard.ZstdCompressor(level=level)
+    with zipfile.ZipFile(zip_path) as archive, \
+            open(output_path, "wb") as output, \
+            compressor.stream_writer(output) as writer, \
+            tarfile.open(fileobj=writer, mode="w|") as tar:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            member = tarfile.TarInfo(info.filename)
+            member.size = info.file_size
+            member.mtime = int(datetime(*info.date_time).timestamp())
+            with archive.open(info) as file:
+                tar.addfile(member, file)
+
+
+async def recompress(zip_path: str, output_path: str) -> None:
+    """
+    Recompress zip backup in pool of processes. Result is written
+    to temporary file first, so it appears only when complete.
+    Can raise *RecompressUnavailableError*.
+    :param zip_path: path to odoo zip backup
+    :param output_path: path to resulting .tar.zst file
+    """
+    global executor
+    if zstandard is None:
+        raise RecompressUnavailableError("zstandard is not installed.")
+    if executor is None:
+        executor = ProcessPoolExecutor(
+            RECOMPRESS_WORKERS,
+            mp_context=get_context("spawn")
+        )
+    part_path = f"{output_path}.part"
+    try:
+        await asyncio.get_running_loop().run_in_executor(
+            executor, recompress_zip, zip_path, part_path, ZSTD_LEVEL
+        )
+        os.replace(part_path, output_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+
+def shutdown() -> None:
+    """
+    Stop pool of processes, it is started again on next recompress.
+    """
+    global executor
+    if executor is not None:
+        executor.shutdown()
+        executor = None
+
+
+class RecompressUnavailableError(Exception):
+    pass
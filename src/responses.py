@@ -1,10 +1,11 @@
 import os
 from urllib.parse import urlparse, urlencode, urlunparse
 from fastapi import Response, status
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse
+from yandex import OAUTH_URL
 
 
-YANDEX_OAUTH = "https://oauth.yandex.ru/authorize"
+YANDEX_OAUTH = f"{OAUTH_URL}/authorize"
 
 
 def redirect_to(url: str):
@@ -36,6 +37,33 @@ def serialize_instances(instances: list[dict]):
     )
 
 
+def serialize_status(runs: list[dict]):
+    """
+    Group runs returned by Database.get_latest_runs by instance.
+    """
+    instances = {}
+    for run in runs:
+        instance = instances.setdefault((run["url"], run["db_name"]), {
+            "url": run["url"],
+            "db_name": run["db_name"],
+            "next_backup": run["next_backup"].isoformat(),
+            "runs": []
+        })
+        if run["started_at"] is None:
+            continue
+        instance["runs"].append({
+            "started_at": run["started_at"].isoformat(),
+            "finished_at": run["finished_at"].isoformat(),
+            "size": run["size"],
+            "bytes_per_second": run["bytes_per_second"],
+            "download_seconds": run["download_seconds"],
+            "recompress_seconds": run["recompress_seconds"],
+            "upload_seconds": run["upload_seconds"],
+            "error": run["error"]
+        })
+    return JSONResponse(list(instances.values()))
+
+
 def get_gateway_timeout_error(text: str):
     return Response(
         status_code=status.HTTP_504_GATEWAY_TIMEOUT,
@@ -97,3 +125,21 @@ WRONG_ODOO_URL_FORMAT = Response(
     content="Wrong odoo url format. It must be link to odoo "
             "database manager, like 'BASE_URL/web/database/manager'"
 )
+
+WRONG_BACKUP_FORMAT = Response(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    media_type="text/plain",
+    content="Wrong backup format. It must be 'zip' or 'zst'."
+)
+
+WRONG_COOLDOWN = Response(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    media_type="text/plain",
+    content="Wrong cooldown. It must be positive count of days."
+)
+
+WRONG_BACKUP_WINDOW = Response(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    media_type="text/plain",
+    content="Wrong backup window. It must be like '22:00-06:00'."
+)
@@ -0,0 +1,109 @@
+"""
+Module with scheduler limiting concurrency of backups.
+"""
+import os
+import asyncio
+from collections import Counter, defaultdict, deque
+from itertools import zip_longest
+from typing import Awaitable, Callable
+from urllib.parse import urlparse
+from loguru import logger
+
+
+class BackupScheduler:
+    def __init__(self, concurrency: int, host_concurrency: int):
+        self.concurrency = concurrency
+        self.host_concurrency = host_concurrency
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            int(os.getenv("BACKUP_CONCURRENCY", "8")),
+            int(os.getenv("BACKUP_HOST_CONCURRENCY", "2"))
+        )
+
+    @staticmethod
+    def fair_order(jobs: list[dict]) -> deque[dict]:
+        """
+        Order jobs round-robin by their owners, so one owner with
+        many instances doesn't delay backups of others.
+        :param jobs: list of jobs with "owner" key
+        :return: queue of jobs
+        """
+        by_owner = defaultdict(list)
+        for job in jobs:
+            by_owner[job["owner"]].append(job)
+        return deque(
+            job
+            for turn in zip_longest(*by_owner.values())
+            for job in turn if job is not None
+        )
+
+    async def run(
+            self, claim: Callable[[int, dict[str, int], int],
+                                  Awaitable[list[dict]]],
+            worker: Callable[[dict], Awaitable],
+            max_pending: int) -> None:
+        """
+        Run worker for claimed jobs, keeping at most *concurrency* of
+        them at once and at most *host_concurrency* for one odoo host.
+        More jobs are claimed as soon as a slot is free, so one long
+        backup doesn't leave other slots idle. Jobs whose host is busy
+        are skipped until it has free slot, so they don't hold global
+        slots. One host holds at most twice *host_concurrency* running
+        and waiting jobs, so it can't fill whole pending queue and
+        block claims of other hosts. Returns when nothing is running
+        and nothing is claimed.
+        :param claim: coroutine function claiming up to given count
+        of jobs with "owner" and "url" keys, skipping jobs of hosts
+        which already hold given max count of jobs by given counts
+        :param worker: coroutine function doing one job
+        :param max_pending: max count of claimed jobs waiting for slot
+        """
+        pending = deque()
+        running: dict[asyncio.Task, str] = {}
+        host_load = Counter()
+        exhausted = False
+
+        def start_pending() -> None:
+            skipped = deque()
+            while pending and len(running) < self.concurrency:
+                job = pending.popleft()
+                host = urlparse(job["url"]).netloc
+                if host_load[host] >= self.host_concurrency:
+                    skipped.append(job)
+                    continue
+                host_load[host] += 1
+                running[asyncio.create_task(worker(job))] = host
+            pending.extendleft(reversed(skipped))
+
+        while True:
+            start_pending()
+            free = min(
+                self.concurrency - len(running),
+                max_pending - len(pending)
+            )
+            if free > 0 and not exhausted:
+                held = host_load + Counter(
+                    urlparse(job["url"]).netloc for job in pending
+                )
+                jobs = await claim(
+                    free, dict(held), 2 * self.host_concurrency
+                )
+                exhausted = len(jobs) < free
+                pending.extend(self.fair_order(jobs))
+                start_pending()
+            if not running:
+                if exhausted:
+                    return
+                continue
+            done, _ = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED
+            )
+            exhausted = False
+            for task in done:
+                host_load[running.pop(task)] -= 1
+                if task.exception() is not None:
+                    logger.opt(exception=task.exception()).error(
+                        "Unexpected error while making backup"
+                    )
@@ -0,0 +1,110 @@
+"""
+Module choosing time of day when every instance is backed up, so
+backups are spread over the day instead of starting at once.
+Slot of instance is minute of day, it stays the same between
+backups and is kept inside maintenance window of instance.
+"""
+import re
+import zlib
+import statistics
+
+
+MINUTES_IN_DAY = 24 * 60
+WINDOW_FORMAT = re.compile(r"^(\d\d):(\d\d)-(\d\d):(\d\d)$")
+
+
+def parse_window(window: str) -> tuple[int | None, int | None]:
+    """
+    Can raise *ValueError*.
+    :param window: maintenance window like "22:00-06:00",
+    which may cross midnight, or empty string for the whole day
+    :return: start and end of window in minutes of day
+    or Nones for the whole day
+    """
+    if not window:
+        return None, None
+    match = WINDOW_FORMAT.match(window)
+    if match is None:
+        raise ValueError(f"Wrong window format: {window}.")
+    start_hour, start_minute, end_hour, end_minute = map(int, match.groups())
+    if start_hour > 23 or end_hour > 23 \
+            or start_minute > 59 or end_minute > 59:
+        raise ValueError(f"Wrong window time: {window}.")
+    return start_hour * 60 + start_minute, end_hour * 60 + end_minute
+
+
+def hour_ranges(
+        start: int | None,
+        end: int | None) -> dict[int, tuple[int, int]]:
+    """
+    :return: minutes of window by hours of day, as dict of hour
+    to the first minute and minute after the last one
+    """
+    if start is None or start == end:
+        spans = [(0, MINUTES_IN_DAY)]
+    elif start < end:
+        spans = [(start, end)]
+    else:
+        spans = [(start, MINUTES_IN_DAY), (0, end)]
+    ranges = {}
+    for low, high in spans:
+        for hour in range(low // 60, (high - 1) // 60 + 1):
+            ranges[hour] = (max(low, hour * 60), min(high, hour * 60 + 60))
+    return ranges
+
+
+def instance_hash(owner: int, url: str, db_name: str) -> int:
+    return zlib.crc32(f"{owner}/{url}/{db_name}".encode())
+
+
+def initial_slot(
+        owner: int,
+        url: str,
+        db_name: str,
+        start: int | None = None,
+        end: int | None = None) -> int:
+    """
+    Pick stable pseudo random slot inside window for new instance.
+    """
+    key = instance_hash(owner, url, db_name)
+    ranges = hour_ranges(start, end)
+    low, high = ranges[sorted(ranges)[key % len(ranges)]]
+    return low + key // len(ranges) % (high - low)
+
+
+def balance_slots(instances: list[dict]) -> list[tuple]:
+    """
+    Give slots to instances so predicted bytes per hour are as flat
+    as possible. Instances are placed one by one from the heaviest
+    into the least loaded hour of their window, where load of instance
+    is size of its last backup divided by its cooldown. Minute inside
+    hour is picked by hash of instance, so it is stable.
+    :param instances: dicts with "owner", "url", "db_name", "cooldown",
+    "size" of last backup or None, "window_start" and "window_end"
+    :return: tuples of slot, owner, url and db_name
+    """
+    known = [instance["size"] for instance in instances if instance["size"]]
+    default_size = statistics.median(known) if known else 1
+    load = [0.0] * 24
+
+    def daily_bytes(instance: dict) -> float:
+        return (
+            (instance["size"] or default_size) / max(instance["cooldown"], 1)
+        )
+
+    slots = []
+    for instance in sorted(instances, key=daily_bytes, reverse=True):
+        key = instance_hash(
+            instance["owner"], instance["url"], instance["db_name"]
+        )
+        ranges = hour_ranges(instance["window_start"], instance["window_end"])
+        hour = min(ranges, key=lambda h: (load[h], (h - key) % 24))
+        load[hour] += daily_bytes(instance)
+        low, high = ranges[hour]
+        slots.append((
+            low + key % (high - low),
+            instance["owner"],
+            instance["url"],
+            instance["db_name"]
+        ))
+    return slots
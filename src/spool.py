@@ -0,0 +1,152 @@
+"""
+Module with on-disk spool for downloaded backups.
+"""
+import os
+import asyncio
+from typing import AsyncIterator
+from loguru import logger
+
+
+CHUNK_SIZE = 1024 * 1024
+RESERVE_SIZE = 16 * CHUNK_SIZE
+
+
+class Spool:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.in_use: set[str] = set()
+        self.reserved = 0
+        self.lock = asyncio.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, shard: int = 0, shards: int = 1):
+        """
+        Create spool from SPOOL_DIR and SPOOL_MAX_BYTES environment
+        variables. Spool is disabled when SPOOL_DIR is not set.
+        When there are several shards, each of them gets its own
+        subdirectory and equal part of the budget, so they don't
+        evict files of each other.
+        :return: instance of Spool or None
+        """
+        directory = os.getenv("SPOOL_DIR")
+        if not directory:
+            return None
+        max_bytes = int(os.getenv("SPOOL_MAX_BYTES", str(20 * 1024 ** 3)))
+        if shards > 1:
+            directory = os.path.join(directory, f"shard-{shard}")
+            max_bytes //= shards
+        return cls(directory, max_bytes)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path(key))
+
+    def evict(self, needed: int) -> int:
+        """
+        Remove least recently used files, which are not in use,
+        until there is *needed* bytes free in the budget.
+        Can raise *SpoolFullError*.
+        :param needed: count of bytes that must fit into spool
+        :return: count of free bytes in the budget
+        """
+        with os.scandir(self.directory) as entries:
+            files = [entry for entry in entries if entry.is_file()]
+        total = sum(entry.stat().st_size for entry in files)
+        candidates = sorted(
+            (entry for entry in files
+             if entry.name.removesuffix(".part") not in self.in_use),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in candidates:
+            if total + needed <= self.max_bytes:
+                break
+            total -= entry.stat().st_size
+            os.remove(entry.path)
+            logger.info(f"Evicted {entry.name} from spool")
+        if total + needed > self.max_bytes:
+            raise SpoolFullError("Not enough space in spool.")
+        return self.max_bytes - total
+
+    async def reserve(self, size: int) -> None:
+        """
+        Reserve bytes of the budget for file being written, evicting
+        files when needed. Reservations of all writers are counted
+        together, so concurrent writers can't take the same free space.
+        Can raise *SpoolFullError*.
+        :param size: count of bytes to reserve
+        """
+        async with self.lock:
+            await asyncio.to_thread(self.evict, self.reserved + size)
+            self.reserved += size
+
+    def unreserve(self, size: int) -> None:
+        """
+        Return reserved bytes which were written or aren't needed.
+        """
+        self.reserved -= size
+
+    async def write(self, key: str, chunks: AsyncIterator[bytes]) -> int:
+        """
+        Write chunks to spool file. File becomes visible under its key
+        only after it was written completely.
+        Can raise *SpoolFullError*.
+        :param key: name of file in spool
+        :param chunks: async iterator over content of file
+        :return: size of written file
+        """
+        self.in_use.add(key)
+        part_path = self.path(f"{key}.part")
+        written = 0
+        reserved = 0
+        try:
+            with open(part_path, "wb") as file:
+                async for chunk in chunks:
+                    if len(chunk) > reserved:
+                        size = max(len(chunk), RESERVE_SIZE)
+                        try:
+                            await self.reserve(size)
+                        except SpoolFullError:
+                            size = len(chunk)
+                            await self.reserve(size)
+                        reserved += size
+                    await asyncio.to_thread(file.write, chunk)
+                    self.unreserve(len(chunk))
+                    reserved -= len(chunk)
+                    written += len(chunk)
+            os.replace(part_path, self.path(key))
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            self.in_use.discard(key)
+            raise
+        finally:
+            self.unreserve(reserved)
+        return written
+
+    async def read(
+            self, key: str,
+            chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """
+        Read spool file by chunks and mark it as recently used.
+        :param key: name of file in spool
+        :param chunk_size: max size of one yielded chunk in bytes
+        :return: async iterator over chunks of file
+        """
+        self.in_use.add(key)
+        os.utime(self.path(key))
+        with open(self.path(key), "rb") as file:
+            while chunk := await asyncio.to_thread(file.read, chunk_size):
+                yield chunk
+
+    def release(self, key: str, remove: bool = False) -> None:
+        self.in_use.discard(key)
+        if remove and self.exists(key):
+            os.remove(self.path(key))
+
+
+class SpoolFullError(Exception):
+    pass
@@ -0,0 +1,140 @@
+"""
+Module detecting stalled transfers by their progress, so hung odoo
+worker or stuck upload doesn't hold backup slot forever.
+"""
+import os
+import asyncio
+from collections import deque
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class Progress:
+    def __init__(self):
+        self.bytes = 0
+
+    async def track(
+            self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        Pass chunks through, counting their bytes.
+        Chunks are closed when wrapper is closed.
+        """
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                self.bytes += len(chunk)
+                yield chunk
+
+
+async def rechunk(
+        chunks: AsyncIterator[bytes],
+        size: int) -> AsyncIterator[bytes]:
+    """
+    Join chunks into chunks of *size* bytes, only the last one
+    can be smaller. Progress is tracked before joining, so it
+    counts bytes as they are read from network.
+    Chunks are closed when wrapper is closed.
+    """
+    buffer = bytearray()
+    async with aclosing(chunks):
+        async for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= size:
+                yield bytes(buffer[:size])
+                del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+
+class StallLimits:
+    def __init__(
+            self, min_bytes_per_second: int,
+            window: float,
+            first_byte_timeout: float):
+        """
+        :param min_bytes_per_second: transfer slower than this over
+        the last *window* seconds is cancelled, 0 disables the check
+        :param window: seconds progress is averaged over
+        :param first_byte_timeout: how long odoo can generate dump
+        before sending the first byte, 0 disables the check
+        """
+        self.min_bytes_per_second = min_bytes_per_second
+        self.window = window
+        self.first_byte_timeout = first_byte_timeout
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            int(os.getenv("STALL_MIN_BYTES_PER_SECOND", str(16 * 1024))),
+            float(os.getenv("STALL_WINDOW_SECONDS", "120")),
+            float(os.getenv("ODOO_FIRST_BYTE_TIMEOUT", "1800"))
+        )
+
+    def override(
+            self, min_bytes_per_second: int | None,
+            first_byte_timeout: float | None):
+        """
+        :return: limits with values which are not None replaced
+        """
+        return StallLimits(
+            self.min_bytes_per_second if min_bytes_per_second is None
+            else min_bytes_per_second,
+            self.window,
+            self.first_byte_timeout if first_byte_timeout is None
+            else first_byte_timeout
+        )
+
+    async def guard(
+            self, transfer: Awaitable[T],
+            progress: Progress,
+            stage: str,
+            first_byte: bool = False) -> T:
+        """
+        Await transfer, cancelling it when it is stalled.
+        Can raise *StalledTransferError* with reason named after stage.
+        :param transfer: awaitable moving bytes counted by progress
+        :param progress: progress of transfer
+        :param stage: name of stage, like "Download"
+        :param first_byte: whether slow start is allowed for
+        *first_byte_timeout*, progress window starts at the first byte
+        :return: result of transfer
+        """
+        task = asyncio.ensure_future(transfer)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        samples = deque([(start, 0)])
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    {task}, timeout=min(self.window / 4, 5)
+                )
+                if done:
+                    return task.result()
+                now = loop.time()
+                if first_byte and progress.bytes == 0:
+                    if self.first_byte_timeout \
+                            and now - start > self.first_byte_timeout:
+                        raise StalledTransferError(f"{stage}FirstByteTimeout")
+                    samples = deque([(now, 0)])
+                    continue
+                samples.append((now, progress.bytes))
+                while len(samples) > 1 and samples[1][0] <= now - self.window:
+                    samples.popleft()
+                since, sent = samples[0]
+                if self.min_bytes_per_second \
+                        and now - since >= self.window \
+                        and progress.bytes - sent \
+                        < self.min_bytes_per_second * (now - since):
+                    raise StalledTransferError(f"{stage}Stalled")
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+
+class StalledTransferError(Exception):
+    def __init__(self, reason: str):
+        super().__init__(f"Transfer was cancelled: {reason}.")
+        self.reason = reason
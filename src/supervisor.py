@@ -0,0 +1,85 @@
+"""
+Module with supervisor of syncer worker processes.
+"""
+import os
+import time
+import threading
+from multiprocessing import get_context
+from loguru import logger
+from metrics import (
+    SYNCER_WORKER_UP,
+    SYNCER_WORKER_RESTARTS,
+    mark_process_dead
+)
+import syncer
+
+
+SUPERVISOR_INTERVAL = 5
+
+
+class Supervisor:
+    def __init__(self, workers: int):
+        """
+        :param workers: count of syncer processes, every one of them
+        backs up its own shard of odoo hosts
+        """
+        self.workers = workers
+        self.context = get_context("spawn")
+        self.processes = [None] * workers
+        self.started_at = [0.0] * workers
+        self.restarts = [0] * workers
+        self.stopping = threading.Event()
+        self.watcher = threading.Thread(target=self.watch, daemon=True)
+
+    @classmethod
+    def from_env(cls):
+        return cls(int(os.getenv("SYNCER_WORKERS", "1")))
+
+    def start_worker(self, shard: int) -> None:
+        process = self.context.Process(
+            target=syncer.main,
+            args=(shard, self.workers),
+            name=f"syncer-{shard}"
+        )
+        process.start()
+        self.processes[shard] = process
+        self.started_at[shard] = time.time()
+        SYNCER_WORKER_UP.labels(shard).set(1)
+
+    def watch(self) -> None:
+        """
+        Restart workers which exited until supervisor is stopped.
+        Worker waits for database before start, so crashing one
+        is restarted once a few seconds.
+        """
+        while not self.stopping.wait(SUPERVISOR_INTERVAL):
+            for shard, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                SYNCER_WORKER_UP.labels(shard).set(0)
+                SYNCER_WORKER_RESTARTS.labels(shard).inc()
+                mark_process_dead(process.pid)
+                self.restarts[shard] += 1
+                logger.error(
+                    f"Syncer worker {shard} exited with code "
+                    f"{process.exitcode} after "
+                    f"{time.time() - self.started_at[shard]:.0f} seconds, "
+                    f"restarting it for {self.restarts[shard]} time."
+                )
+                self.start_worker(shard)
+
+    def start(self) -> None:
+        """
+        Start workers and thread watching them.
+        """
+        for shard in range(self.workers):
+            self.start_worker(shard)
+        self.watcher.start()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.watcher.join()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
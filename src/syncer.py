@@ -1,17 +1,119 @@
+import os
 import time
+import signal
 import asyncio
-from checkers import refresh_yandex_tokens, backup_all_instances
+from contextlib import suppress
+from checkers import backup_all_instances
+from database import Database
+from tokens import TokenManager
+from slots import balance_slots
+from http_clients import close_clients
+from recompress import shutdown as shutdown_recompress
+from log_config import setup_logging, shutdown_logging
 from loguru import logger
+from prometheus_client import start_http_server
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
-async def sync():
-    while True:
-        logger.info("Going to refresh tokens and backup odoo instances.")
-        await refresh_yandex_tokens()
-        await backup_all_instances()
-        time.sleep(3600 * 10)
 
+NOTIFY_CHANNEL = "odoo_instances_changed"
+SYNC_MIN_SLEEP = int(os.getenv("SYNC_MIN_SLEEP", "60"))
+SYNC_MAX_SLEEP = int(os.getenv("SYNC_MAX_SLEEP", "3600"))
+SYNCER_METRICS_PORT = int(os.getenv("SYNCER_METRICS_PORT", "8001"))
+SYNC_LEADER_RETRY = float(os.getenv("SYNC_LEADER_RETRY", "5"))
+BACKUP_REBALANCE_HOURS = float(os.getenv("BACKUP_REBALANCE_HOURS", "24"))
 
-def main():
-    time.sleep(10)
-    asyncio.run(sync())
+
+async def sleep_until_wakeup(db: Database, wakeup: asyncio.Event) -> None:
+    """
+    Sleep until something in database becomes due
+    or instances are changed.
+    """
+    delay = await db.get_seconds_to_wakeup()
+    if delay is None:
+        delay = SYNC_MAX_SLEEP
+    delay = min(max(delay, SYNC_MIN_SLEEP), SYNC_MAX_SLEEP)
+    logger.info(f"Sleeping for {delay:.0f} seconds.")
+    with suppress(asyncio.TimeoutError):
+        await asyncio.wait_for(wakeup.wait(), delay)
+
+
+async def rebalance_slots(db: Database) -> None:
+    """
+    Move backup slots of instances to flatten predicted
+    bytes per hour, using sizes of their last backups.
+    """
+    slots = await asyncio.to_thread(balance_slots, await db.get_slot_inputs())
+    await db.update_backup_slots(slots)
+    logger.info(f"Backup slots of {len(slots)} instances were rebalanced.")
+
+
+async def sync(shard: int = 0, shards: int = 1):
+    db = await Database.connect(
+        host=os.environ["PG_HOST"],
+        port=int(os.environ["PG_PORT"]),
+        username=os.environ["PG_USER"],
+        password=os.environ["PG_PASSWORD"],
+        database=os.environ["PG_DATABASE"],
+        min_size=int(os.getenv("PG_POOL_MIN_SIZE", "2")),
+        max_size=int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+    )
+    tokens = TokenManager.from_env(db)
+    wakeup = asyncio.Event()
+    rebalanced_at = None
+    try:
+        async with db.syncer_leadership(shard, SYNC_LEADER_RETRY) as lock, \
+                db.listen(NOTIFY_CHANNEL, wakeup.set):
+            logger.info(f"Syncer became leader of shard {shard}.")
+            while not lock.is_closed():
+                wakeup.clear()
+                logger.info(
+                    "Going to refresh tokens and backup odoo instances."
+                )
+                if shard == 0 and BACKUP_REBALANCE_HOURS and (
+                        rebalanced_at is None
+                        or time.monotonic() - rebalanced_at
+                        > BACKUP_REBALANCE_HOURS * 3600):
+                    await rebalance_slots(db)
+                    rebalanced_at = time.monotonic()
+                await tokens.refresh_due(shard, shards)
+                await backup_all_instances(db, tokens, shard, shards)
+                await sleep_until_wakeup(db, wakeup)
+            raise LeadershipLostError(
+                f"Connection holding leadership of shard {shard} was lost."
+            )
+    finally:
+        await db.close()
+        await close_clients()
+        shutdown_recompress()
+
+
+class LeadershipLostError(Exception):
+    pass
+
+
+def terminate(signum, frame):
+    raise SystemExit(0)
+
+
+def main(shard: int = 0, shards: int = 1):
+    """
+    Run syncer of one shard, every shard exposes metrics
+    on its own port starting from SYNCER_METRICS_PORT.
+    SIGTERM sent by supervisor exits through *finally* blocks,
+    so connections are closed and buffered logs are written.
+    """
+    signal.signal(signal.SIGTERM, terminate)
+    setup_logging(f"syncer-{shard}")
+    try:
+        start_http_server(SYNCER_METRICS_PORT + shard)
+        time.sleep(10)
+        if uvloop is not None:
+            uvloop.install()
+        asyncio.run(sync(shard, shards))
+    finally:
+        logger.info(f"Syncer of shard {shard} is stopping.")
+        shutdown_logging()
@@ -0,0 +1,135 @@
+"""
+Module with manager of yandex tokens of users.
+"""
+import os
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+from loguru import logger
+from database import Database
+from yandex import YandexID, YandexResponseError
+from metrics import TOKEN_REFRESH_LAG_SECONDS
+
+
+class TokenManager:
+    def __init__(
+            self, db: Database,
+            concurrency: int,
+            batch_size: int,
+            retry_delay: int = 600,
+            max_retry_delay: int = 36000):
+        """
+        :param db: database with tokens of users
+        :param concurrency: max count of requests to yandex at once
+        :param batch_size: count of users refreshed and saved at once
+        :param retry_delay: seconds before token which failed to refresh
+        is tried again, doubled after every failure in a row
+        :param max_retry_delay: max seconds between attempts
+        """
+        self.db = db
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.locks: defaultdict[int, asyncio.Lock] = \
+            defaultdict(asyncio.Lock)
+
+    @classmethod
+    def from_env(cls, db: Database):
+        return cls(
+            db,
+            int(os.getenv("TOKEN_REFRESH_CONCURRENCY", "8")),
+            int(os.getenv("TOKEN_REFRESH_BATCH", "500")),
+            int(os.getenv("TOKEN_REFRESH_RETRY_DELAY", "600")),
+            int(os.getenv("TOKEN_REFRESH_MAX_RETRY_DELAY", "36000"))
+        )
+
+    @staticmethod
+    async def request_new_token(yandex_id: int, refresh_token: str) -> dict:
+        """
+        Exchange refresh token for new pair of tokens.
+        Can raise *YandexResponseError*.
+        :return: dict in format of Database.update_user_tokens
+        """
+        token, new_refresh_token, expires_in = \
+            await YandexID.get_new_token(refresh_token)
+        return {
+            "id": yandex_id,
+            "token": token,
+            "refresh_token": new_refresh_token,
+            "due_date": datetime.now() + timedelta(seconds=expires_in)
+        }
+
+    async def refresh_due(self, shard: int = 0, shards: int = 1) -> None:
+        """
+        Refresh tokens of all users of shard whose tokens expire soon,
+        batch by batch as they are read from database.
+        """
+        async for users in self.db.iter_tokens_to_refresh(
+                self.batch_size, shard, shards):
+            await self.refresh_batch(users)
+        TOKEN_REFRESH_LAG_SECONDS.set(await self.db.get_token_refresh_lag())
+
+    async def refresh_batch(self, users: list[dict]) -> None:
+        """
+        Request yandex for tokens of users concurrently and save them
+        in one batch. Lock of every user is held until they are saved.
+        Users whose refresh failed are retried later with backoff.
+        :param users: list of dicts with "id" and "refresh_token" keys
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        held = []
+
+        async def refresh(user: dict) -> dict | None:
+            lock = self.locks[user["id"]]
+            await lock.acquire()
+            held.append(lock)
+            async with semaphore:
+                try:
+                    return await self.request_new_token(
+                        user["id"], user["refresh_token"]
+                    )
+                except YandexResponseError:
+                    logger.error(
+                        "Yandex error was caught while refreshing token."
+                    )
+
+        try:
+            results = await asyncio.gather(*[refresh(u) for u in users])
+            refreshed = [res for res in results if res is not None]
+            if refreshed:
+                await self.db.update_user_tokens(refreshed)
+            failed = [
+                user["id"] for user, res in zip(users, results)
+                if res is None
+            ]
+            if failed:
+                await self.db.postpone_token_refresh(
+                    failed, self.retry_delay, self.max_retry_delay
+                )
+        finally:
+            for lock in held:
+                lock.release()
+        for user in refreshed:
+            logger.info(f"Refreshed token for {user['id']}")
+
+    async def refresh_token(self, yandex_id: int, stale_token: str) -> str:
+        """
+        Refresh token of user after yandex rejected it. Parallel calls
+        for one user make only one request to yandex, the rest get
+        the token it saved.
+        Can raise *YandexResponseError*.
+        :param yandex_id: id of user
+        :param stale_token: token which was rejected
+        :return: valid token
+        """
+        async with self.locks[yandex_id]:
+            tokens = await self.db.get_user_tokens(yandex_id)
+            if tokens["token"] != stale_token:
+                return tokens["token"]
+            new_tokens = await self.request_new_token(
+                yandex_id, tokens["refresh_token"]
+            )
+            await self.db.update_user_tokens([new_tokens])
+            logger.info(f"Refreshed rejected token for {yandex_id}")
+            return new_tokens["token"]
@@ -1,9 +1,20 @@
 import os
+import json
 from uuid import uuid4
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from dependencies import get_cache
-from responses import redirect_to_yandex_oauth, WRONG_ODOO_URL_FORMAT
+from responses import (
+    redirect_to_yandex_oauth,
+    get_bad_request_error,
+    WRONG_ODOO_URL_FORMAT,
+    WRONG_BACKUP_FORMAT,
+    WRONG_BACKUP_WINDOW,
+    WRONG_COOLDOWN
+)
 from cache import Cache
+from recompress import FORMATS
+from bulk import parse_instances, BulkFormatError
+from slots import parse_window
 
 
 router = APIRouter()
@@ -15,9 +26,19 @@ async def post_instance(
         db_name: str,
         db_password: str,
         cooldown: int,
+        backup_format: str = "zip",
+        backup_window: str = "",
         cache: Cache = Depends(get_cache)):
     if not url.endswith("manager"):
         return WRONG_ODOO_URL_FORMAT
+    if cooldown < 1:
+        return WRONG_COOLDOWN
+    if backup_format not in FORMATS:
+        return WRONG_BACKUP_FORMAT
+    try:
+        parse_window(backup_window)
+    except ValueError:
+        return WRONG_BACKUP_WINDOW
     request_id = str(uuid4())
     await cache.put_record(
         request_id,
@@ -25,7 +46,27 @@ async def post_instance(
         url=url,
         db_name=db_name,
         db_password=db_password,
-        cooldown=cooldown
+        cooldown=cooldown,
+        backup_format=backup_format,
+        backup_window=backup_window
+    )
+    return redirect_to_yandex_oauth(request_id)
+
+
+@router.post("/post_instances")
+async def post_instances(request: Request, cache: Cache = Depends(get_cache)):
+    try:
+        rows = parse_instances(
+            await request.body(),
+            request.headers.get("Content-Type", "")
+        )
+    except BulkFormatError as error:
+        return get_bad_request_error(str(error))
+    request_id = str(uuid4())
+    await cache.put_record(
+        request_id,
+        redirect_url=f"{os.environ['ROOT_PATH']}/authorized/post_instances",
+        instances=json.dumps(rows)
     )
     return redirect_to_yandex_oauth(request_id)
 
@@ -40,6 +81,17 @@ async def get_instance(cache: Cache = Depends(get_cache)):
     return redirect_to_yandex_oauth(request_id)
 
 
+@router.get("/status")
+async def get_status(runs: int = 5, cache: Cache = Depends(get_cache)):
+    request_id = str(uuid4())
+    await cache.put_record(
+        request_id,
+        redirect_url=f"{os.environ['ROOT_PATH']}/authorized/status",
+        runs=max(1, min(runs, 50))
+    )
+    return redirect_to_yandex_oauth(request_id)
+
+
 @router.get("/delete_instance")
 async def get_instance(
         url: str,
@@ -2,44 +2,231 @@
 Module that provides wrapper under yandex API.
 """
 import os
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable
 import httpx
 from loguru import logger
+from http_clients import get_client
+from metrics import timed
+
+
+DISK_API = os.getenv("YANDEX_DISK_API", "https://cloud-api.yandex.net/v1/disk")
+OAUTH_URL = os.getenv("YANDEX_OAUTH_URL", "https://oauth.yandex.ru")
+LOGIN_URL = os.getenv("YANDEX_LOGIN_URL", "https://login.yandex.ru")
+OPERATION_POLL_INTERVAL = float(
+    os.getenv("YANDEX_OPERATION_POLL_INTERVAL", "2")
+)
+OPERATION_TIMEOUT = float(os.getenv("YANDEX_OPERATION_TIMEOUT", "3600"))
 
 
 class YandexDisk:
-    def __init__(self, token: str):
-        self.client = httpx.AsyncClient(
-            base_url="https://cloud-api.yandex.net/v1/disk",
-            headers={
-                "Authorization": f"OAuth {token}"
-            }
-        )
+    def __init__(
+            self, token: str,
+            refresh_token: Callable[[str], Awaitable[str]] | None = None):
+        """
+        :param token: access token of user
+        :param refresh_token: coroutine function getting rejected token
+        and returning new one, it is called once when yandex responds
+        with HTTP 401
+        """
+        self.token = token
+        self.refresh_token = refresh_token
 
-    async def close(self):
-        await self.client.aclose()
+    @property
+    def headers(self) -> dict[str, str]:
+        return {"Authorization": f"OAuth {self.token}"}
 
-    async def put_file(self, filename: str, file: bytes) -> None:
+    async def send(
+            self, method: str,
+            resource: str,
+            params: dict[str, str]) -> httpx.Response:
+        """
+        Send request to disk API. Rejected token is refreshed once
+        and request is sent again.
+        Can raise *httpx.HTTPError* and *WrongTokenError*.
+        :param method: HTTP method
+        :param resource: path of API method after DISK_API
+        :param params: query parameters
+        :return: response which isn't HTTP 401
+        """
+        token = self.token
+        res = await get_client(DISK_API).request(
+            method, f"{DISK_API}/{resource}",
+            params=params, headers=self.headers
+        )
+        if res.status_code == 401 and self.refresh_token is not None:
+            self.token = await self.refresh_token(token)
+            res = await get_client(DISK_API).request(
+                method, f"{DISK_API}/{resource}",
+                params=params, headers=self.headers
+            )
+        if res.status_code == 401:
+            logger.warning(f"Wrong token got from yandex disk - {resource}")
+            raise WrongTokenError("Wrong token.")
+        return res
+
+    @timed("yandex")
+    async def request_upload_url(
+            self, filename: str,
+            overwrite: bool = False) -> str:
+        """
+        Can raise *YandexResponseError* and *WrongTokenError*.
+        :param filename: name of file in application folder
+        :param overwrite: replace file if it exists, otherwise
+        yandex responds with HTTP 409
+        :return: url to upload file to
+        """
         try:
-            upload_request = await self.client.get(
-                "https://cloud-api.yandex.net/v1/disk/resources/upload",
-                params={"path": f"app:/{filename}"}
+            upload_request = await self.send(
+                "GET", "resources/upload",
+                {
+                    "path": f"app:/{filename}",
+                    "overwrite": str(overwrite).lower()
+                }
             )
             upload_request.raise_for_status()
         except httpx.HTTPError as err:
             logger.error("Error occurred while "
                          f"requesting upload url - {str(err)}")
             raise YandexResponseError("Error while requesting upload url.")
-        upload_url = upload_request.json()["href"]
+        return upload_request.json()["href"]
+
+    async def put_file(
+            self, filename: str,
+            file: bytes | AsyncIterator[bytes],
+            overwrite: bool = False) -> None:
+        """
+        Upload file to application folder on yandex disk.
+        File can be passed as async iterator over chunks, then it is
+        sent to yandex while being read, without buffering it whole.
+        Rejected token is refreshed once before file is read.
+        Can raise *YandexResponseError* and *WrongTokenError*.
+        :param filename: name of file in application folder
+        :param file: content of file or async iterator over its chunks
+        :param overwrite: replace file if it exists
+        """
+        upload_url = await self.request_upload_url(filename, overwrite)
         try:
-            res = await self.client.put(upload_url, content=file, timeout=None)
+            res = await get_client(upload_url).put(
+                upload_url,
+                content=file,
+                headers=self.headers,
+                timeout=None
+            )
             res.raise_for_status()
         except httpx.HTTPError as err:
             logger.error(f"Error occurred while uploading file - {str(err)}")
             raise YandexResponseError("Error while uploading file.")
 
+    @timed("yandex")
+    async def copy_file(self, source: str, filename: str) -> None:
+        """
+        Copy file inside application folder on yandex side,
+        without uploading it again. Big files are copied
+        asynchronously, then operation is waited for.
+        Can raise *YandexResponseError* and *WrongTokenError*.
+        :param source: name of existing file in application folder
+        :param filename: name of new file in application folder
+        """
+        try:
+            res = await self.send(
+                "POST", "resources/copy",
+                {
+                    "from": f"app:/{source}",
+                    "path": f"app:/{filename}",
+                    "overwrite": "true"
+                }
+            )
+            res.raise_for_status()
+        except httpx.HTTPError as err:
+            logger.error(f"Error occurred while copying file - {str(err)}")
+            raise YandexResponseError("Error while copying file.")
+        if res.status_code == 202:
+            await self.wait_operation(res.json()["href"])
+
+    async def wait_operation(self, operation_url: str) -> None:
+        """
+        Poll asynchronous operation until it is finished.
+        Can raise *YandexResponseError* when operation failed
+        or didn't finish in OPERATION_TIMEOUT seconds.
+        :param operation_url: link to status of operation
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + OPERATION_TIMEOUT
+        while True:
+            try:
+                res = await get_client(operation_url).get(
+                    operation_url, headers=self.headers
+                )
+                res.raise_for_status()
+            except httpx.HTTPError as err:
+                logger.error(
+                    f"Error occurred while checking operation - {str(err)}"
+                )
+                raise YandexResponseError("Error while checking operation.")
+            status = res.json()["status"]
+            if status == "success":
+                return
+            if status == "failed":
+                logger.error(f"Yandex operation failed - {operation_url}")
+                raise YandexResponseError("Operation failed.")
+            if loop.time() > deadline:
+                logger.error(f"Yandex operation timed out - {operation_url}")
+                raise YandexResponseError("Operation timed out.")
+            await asyncio.sleep(OPERATION_POLL_INTERVAL)
+
+    @timed("yandex")
+    async def create_folder(self, name: str) -> None:
+        """
+        Create folder in application folder, existing folder is kept.
+        Can raise *YandexResponseError* and *WrongTokenError*.
+        :param name: name of folder in application folder
+        """
+        try:
+            res = await self.send(
+                "PUT", "resources", {"path": f"app:/{name}"}
+            )
+            if res.status_code != 409:
+                res.raise_for_status()
+        except httpx.HTTPError as err:
+            logger.error(f"Error occurred while creating folder - {str(err)}")
+            raise YandexResponseError("Error while creating folder.")
+
+    async def stream_file(
+            self, filename: str,
+            chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        """
+        Download file from application folder by chunks.
+        Can raise *YandexResponseError* while iterating.
+        :param filename: name of file in application folder
+        :param chunk_size: max size of one yielded chunk in bytes
+        :return: async iterator over chunks of file
+        """
+        try:
+            download_request = await get_client(DISK_API).get(
+                f"{DISK_API}/resources/download",
+                params={"path": f"app:/{filename}"},
+                headers=self.headers
+            )
+            download_request.raise_for_status()
+            download_url = download_request.json()["href"]
+            async with get_client(download_url).stream(
+                    "GET",
+                    download_url,
+                    headers=self.headers,
+                    follow_redirects=True,
+                    timeout=None) as res:
+                res.raise_for_status()
+                async for chunk in res.aiter_bytes(chunk_size):
+                    yield chunk
+        except httpx.HTTPError as err:
+            logger.error(f"Error occurred while downloading file - {str(err)}")
+            raise YandexResponseError("Error while downloading file.")
+
 
 class YandexID:
     @staticmethod
+    @timed("yandex")
     async def change_code_to_token(code: str) -> tuple[str, str, int]:
         """
         Method requesting yandex to change authentication code to token.
@@ -50,21 +237,20 @@ class YandexID:
         refresh_token,
         expires_in
         """
-        async with httpx.AsyncClient() as cl:
-            try:
-                res = await cl.post(
-                    "https://oauth.yandex.ru/token",
-                    data={
-                        "grant_type": "authorization_code",
-                        "code": code
-                    },
-                    auth=(
-                        os.environ["YANDEX_APP_ID"],
-                        os.environ["YANDEX_APP_SECRET"]
-                    ))
-            except httpx.TimeoutException:
-                logger.error("Time limit exceeded while changing code to token.")
-                raise YandexTimeoutError("Yandex didn't respond.")
+        try:
+            res = await get_client(OAUTH_URL).post(
+                f"{OAUTH_URL}/token",
+                data={
+                    "grant_type": "authorization_code",
+                    "code": code
+                },
+                auth=(
+                    os.environ["YANDEX_APP_ID"],
+                    os.environ["YANDEX_APP_SECRET"]
+                ))
+        except httpx.TimeoutException:
+            logger.error("Time limit exceeded while changing code to token.")
+            raise YandexTimeoutError("Yandex didn't respond.")
         if res.status_code // 100 == 2:
             json_res = res.json()
             return (
@@ -80,6 +266,7 @@ class YandexID:
         )
 
     @staticmethod
+    @timed("yandex")
     async def get_user_id(token: str) -> int:
         """
         Method requesting yandex API to get user id
@@ -89,17 +276,16 @@ class YandexID:
         :param token: access token of user.
         :return: user's id in yandex's system
         """
-        async with httpx.AsyncClient() as cl:
-            try:
-                res = await cl.get(
-                    "https://login.yandex.ru/info",
-                    headers={"Authorization": f"OAuth {token}"}
-                )
-            except httpx.TimeoutException:
-                logger.error(
-                    "Time limit exceeded while getting user id from token."
-                )
-                raise YandexTimeoutError("Yandex didn't respond.")
+        try:
+            res = await get_client(LOGIN_URL).get(
+                f"{LOGIN_URL}/info",
+                headers={"Authorization": f"OAuth {token}"}
+            )
+        except httpx.TimeoutException:
+            logger.error(
+                "Time limit exceeded while getting user id from token."
+            )
+            raise YandexTimeoutError("Yandex didn't respond.")
         if res.status_code // 100 == 2:
             return res.json()["id"]
         if res.status_code == 401:
@@ -113,31 +299,31 @@ class YandexID:
         )
 
     @staticmethod
+    @timed("yandex")
     async def get_new_token(refresh_token: str) -> tuple[str, str, str]:
-        async with httpx.AsyncClient() as cl:
-            try:
-                res = await cl.post(
-                    "https://oauth.yandex.ru/token",
-                    data={
-                        "grant_type": "refresh_token",
-                        "refresh_token": refresh_token
-                    },
-                    auth=(
-                        os.environ["YANDEX_APP_ID"],
-                        os.environ["YANDEX_APP_SECRET"]
-                    )
+        try:
+            res = await get_client(OAUTH_URL).post(
+                f"{OAUTH_URL}/token",
+                data={
+                    "grant_type": "refresh_token",
+                    "refresh_token": refresh_token
+                },
+                auth=(
+                    os.environ["YANDEX_APP_ID"],
+                    os.environ["YANDEX_APP_SECRET"]
                 )
-                res.raise_for_status()
-            except httpx.HTTPError as err:
-                logger.error("Error occurred while requesting "
-                             f"refresh token - {str(err)}")
-                raise YandexResponseError("Error while getting refresh token.")
-            response_data = res.json()
-            return (
-                response_data["access_token"],
-                response_data["refresh_token"],
-                response_data["expires_in"]
             )
+            res.raise_for_status()
+        except httpx.HTTPError as err:
+            logger.error("Error occurred while requesting "
+                         f"refresh token - {str(err)}")
+            raise YandexResponseError("Error while getting refresh token.")
+        response_data = res.json()
+        return (
+            response_data["access_token"],
+            response_data["refresh_token"],
+            response_data["expires_in"]
+        )
 
 
 class YandexResponseError(Exception):
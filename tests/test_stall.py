@@ -0,0 +1,65 @@
+"""
+Stall watchdog against local stand-ins of odoo and yandex disk,
+odoo streams backup slightly faster than the allowed minimum.
+"""
+import os
+import sys
+import socket
+import asyncio
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [os.path.join(ROOT, "src"), os.path.join(ROOT, "benchmarks")]
+
+from fakes import start_disk, start_odoo, wait_for_port  # noqa: E402
+
+
+HOST = "127.0.0.1"
+SIZE = 2_500_000
+SPEED = 200_000
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def servers():
+    odoo_port, disk_port = free_port(), free_port()
+    os.environ["YANDEX_DISK_API"] = f"http://{HOST}:{disk_port}/v1/disk"
+    odoo = start_odoo(HOST, odoo_port, SIZE, SPEED)
+    disk, received = start_disk(HOST, disk_port)
+    wait_for_port(HOST, odoo_port)
+    wait_for_port(HOST, disk_port)
+    yield f"http://{HOST}:{odoo_port}/web/database/manager", received
+    odoo.terminate()
+    disk.terminate()
+
+
+@pytest.mark.parametrize("spooled", [False, True])
+def test_transfer_above_minimum_speed_is_not_cancelled(
+        servers, spooled, tmp_path):
+    from checkers import backup_odoo_instance
+    from http_clients import close_clients
+    from spool import Spool
+    from stall import StallLimits
+
+    url, received = servers
+    received.value = 0
+
+    async def backup():
+        try:
+            return await backup_odoo_instance(
+                "token", url, "db", "admin",
+                Spool(str(tmp_path), SIZE * 2) if spooled else None,
+                limits=StallLimits(150_000, 4, 60)
+            )
+        finally:
+            await close_clients()
+
+    report = asyncio.run(backup())
+    assert report["error"] is None
+    assert report["size"] == SIZE
+    assert received.value == SIZE